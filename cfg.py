@@ -17,10 +17,10 @@ DOCS_DIR = os.path.join(STORAGE_DIR, "docs")
 os.makedirs(DOCS_DIR, exist_ok=True)
 SUMMARIES_DIR = os.path.join(STORAGE_DIR, "summaries")
 os.makedirs(SUMMARIES_DIR, exist_ok=True)
+VECTORS_DIR = os.path.join(STORAGE_DIR, "vectors")
+os.makedirs(VECTORS_DIR, exist_ok=True)
 
 DB_PATH = os.path.join(STORAGE_DIR, "db.sqlite")
-USELESS_DIR = os.path.join(STORAGE_DIR, "useless")
-os.makedirs(USELESS_DIR, exist_ok=True)
 
 
 @dataclass
@@ -29,8 +29,102 @@ class IOConfig:
     storage_dir: str = STORAGE_DIR
     docs_dir: str = DOCS_DIR
     summaries_dir: str = SUMMARIES_DIR
+    vectors_dir: str = VECTORS_DIR
     db_path: str = DB_PATH
-    useless_dir: str = USELESS_DIR
 
 
 IO_CONFIG = IOConfig()
+
+
+@dataclass
+class DatabaseConfig:
+    max_idle_connections: int = 16
+    busy_timeout_ms: int = 30_000
+    synchronous: str = "NORMAL"
+    mmap_size: int = 256 * 1024 * 1024
+    cache_size_kib: int = 64 * 1024
+
+
+DATABASE_CONFIG = DatabaseConfig()
+
+
+@dataclass
+class CrawlConfig:
+    max_concurrency: int = 8
+    viewport_width: int = 1920
+    viewport_height: int = 1080
+    http_timeout: float = 30.0
+    max_sitemaps: int = 1000
+    max_retries: int = 3
+    retry_base_delay: float = 2.0
+    host_requests_per_second: float = 4.0
+    host_initial_concurrency: int = 4
+    host_max_concurrency: int = 8
+    host_latency_factor: float = 3.0
+    host_slow_samples: int = 8
+    process_workers: int = 0
+
+
+CRAWL_CONFIG = CrawlConfig()
+
+
+@dataclass
+class ParserConfig:
+    max_concurrency: int = 16
+    requests_per_minute: int = 1000
+    tokens_per_minute: int = 1_000_000
+    max_retries: int = 4
+    retry_base_delay: float = 2.0
+    dedup: bool = True
+    dedup_max_distance: int = 3
+    dedup_min_words: int = 50
+    max_document_tokens: int = 24_000
+    max_chunk_concurrency: int = 4
+    batch_small_documents: bool = True
+    small_document_tokens: int = 1_500
+    max_batch_documents: int = 10
+    max_batch_tokens: int = 12_000
+
+
+PARSER_CONFIG = ParserConfig()
+
+
+@dataclass
+class PipelineConfig:
+    queue_size: int = 64
+    summarize_workers: int = 8
+
+
+PIPELINE_CONFIG = PipelineConfig()
+
+
+@dataclass
+class RunnerConfig:
+    config_file: str = os.path.join(ROOT_DIR, "knowledge_bases.toml")
+    max_jobs: int = 4
+    progress_interval: float = 30.0
+
+
+RUNNER_CONFIG = RunnerConfig()
+
+
+@dataclass
+class SearchConfig:
+    bm25_top_k: int = 40
+    bm25_k1: float = 1.5
+    bm25_b: float = 0.75
+    bm25_rebuild_interval: float = 30.0
+    vector_dims: int = 2048
+    vector_top_k: int = 5
+    vector_block_rows: int = 8192
+    vector_rebuild_interval: float = 30.0
+    query_cache_size: int = 512
+    query_cache_ttl: float = 3600.0
+    query_cache_version_interval: float = 1.0
+    catalog_refresh_interval: float = 1.0
+    max_llm_searches: int = 8
+    max_candidate_tokens: int = 8_000
+    max_response_tokens: int = 20_000
+
+
+SEARCH_CONFIG = SearchConfig()
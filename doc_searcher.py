@@ -1,25 +1,69 @@
 from mcp.server.fastmcp import FastMCP
+import asyncio
 import multiprocessing as mp
 from src.agents.discoverer import get_discoverer_response
-from src.models.knowledge import KnowledgeBase
+from src.models.knowledge import Resource
+from src.search.catalog import RESOURCE_CATALOG
+from src.search.query_cache import QueryCache
+from src.search.retrieval import RETRIEVAL_ERROR, get_retrieval_response
 
 from scripts.db_init import db_init
 
 mcp = FastMCP("Technical Documentation Search")
+query_cache = QueryCache()
 
 
+# The tag of the search prompts may name several knowledge bases or globs,
+# e.g. "phoenix_docs,live_view_docs,fly_docs:deploying a LiveView app" or
+# "ash_*:policies"
 @mcp.prompt()
-def search_documentation(tag_and_query: str):
+async def search_documentation(tag_and_query: str):
     tag, query = tag_and_query.split(":")
-    return get_discoverer_response(tag, query)
+    return await query_cache.get_or_compute(
+        "discoverer",
+        tag,
+        query,
+        get_discoverer_response,
+        cacheable=lambda result: result != RETRIEVAL_ERROR,
+    )
 
 
 @mcp.prompt()
-def list_knowledge_bases():
-    all_knowledge_bases = KnowledgeBase.get_knowledge_bases()
-    return "\n".join(f"{kb.name}" for kb in all_knowledge_bases)
+async def quick_search_documentation(tag_and_query: str):
+    # Local vector search only - no LLM round trip
+    tag, query = tag_and_query.split(":")
+    return await query_cache.get_or_compute(
+        "retrieval", tag, query, get_retrieval_response
+    )
+
+
+@mcp.tool()
+async def keyword_search(knowledge_base: str, query: str, limit: int = 10) -> str:
+    """Exact keyword or identifier lookup (e.g. a function name) in the pages and summaries of a knowledge base"""
+    if not query.split():
+        return "The query is empty."
+    hits = await asyncio.to_thread(Resource.search_text, knowledge_base, query, limit)
+    if not hits:
+        return "No matches found."
+    return "\n\n".join(
+        f"{hit.identifier} ({hit.summary_file_path})\n{hit.snippet}" for hit in hits
+    )
+
+
+@mcp.tool()
+def query_cache_stats() -> str:
+    """Hit/miss statistics of the search result cache"""
+    return query_cache.describe()
+
+
+@mcp.prompt()
+async def list_knowledge_bases():
+    names = await asyncio.to_thread(RESOURCE_CATALOG.knowledge_base_names)
+    return "\n".join(names)
 
 
 if __name__ == "__main__":
     db_init()
+    # The resource catalog is loaded before the first query arrives
+    RESOURCE_CATALOG.refresh(force=True)
     mcp.run()
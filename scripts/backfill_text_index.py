@@ -0,0 +1,33 @@
+import logging
+
+from scripts.db_init import db_init
+from src.llm_parser import get_all_files_for_processing
+from src.models.knowledge import KnowledgeBase, Resource
+from src.utils.loggers import setup_stdout_logging
+
+logger = logging.getLogger(__name__)
+
+
+def backfill_text_index():
+    # Resources summarized before the full-text index existed have no text
+    # rows yet - re-upserting them indexes their summary and page markdown
+    for knowledge_base in KnowledgeBase.get_knowledge_bases():
+        resources = Resource.get_resources_by_knowledge_base(knowledge_base.name)
+        if not resources:
+            continue
+        identifiers = {r.identifier for r in resources}
+        page_markdowns = {}
+        for name, page_file in get_all_files_for_processing(knowledge_base.name):
+            if name in identifiers:
+                with open(page_file, "r") as f:
+                    page_markdowns[name] = f.read()
+        Resource.upsert_resources(resources, page_markdowns)
+        logger.info(
+            f"Indexed {len(resources)} resources ({len(page_markdowns)} pages) for {knowledge_base.name}"
+        )
+
+
+if __name__ == "__main__":
+    db_init()
+    setup_stdout_logging()
+    backfill_text_index()
@@ -0,0 +1,84 @@
+import argparse
+import random
+import time
+import tracemalloc
+from urllib.parse import urljoin, urlparse
+
+from bs4 import BeautifulSoup
+
+from src.crawler.links import extract_crawlable_links
+
+BASE_URL = "https://hexdocs.pm/ash/"
+PAGE_URL = "https://hexdocs.pm/ash/Ash.Changeset.html"
+
+
+def synthetic_page(n_links: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    targets = [
+        "Ash.Query.html#filter/2",
+        "Ash.Resource.html",
+        "../ash_postgres/readme.html",
+        "https://github.com/ash-project/ash",
+        "dsl-ash-resource.html#attributes",
+        "assets/app.js",
+        "getting-started",
+        "#functions",
+    ]
+    body = []
+    for i in range(n_links):
+        body.append(
+            f'<section id="s{i}"><h2>Function {i}</h2><p>Some <code>text</code> about '
+            f'<a class="link" href="{rng.choice(targets)}?v={i % 7}">thing {i}</a> and more '
+            f"prose to mimic an API reference entry.</p><pre><code>Ash.run({i})</code></pre></section>"
+        )
+    return f"<html><head><title>t</title></head><body><nav></nav>{''.join(body)}</body></html>"
+
+
+def bs4_links(html: str, page_url: str, base_url: str):
+    soup = BeautifulSoup(html, "html.parser")
+    links = [
+        urljoin(page_url, a.get("href")) for a in soup.find_all("a") if a.get("href")  # type: ignore
+    ]
+    return sorted(
+        {
+            link.split("#")[0]
+            for link in links
+            if link.startswith(base_url)
+            and (
+                urlparse(link).path.endswith((".html", ".md"))
+                or urlparse(link).path.split("/")[-1].split(".")[0]
+                == urlparse(link).path.split("/")[-1]
+            )
+        }
+    )
+
+
+def measure(fn, html: str, repeats: int):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        result = fn(html, PAGE_URL, BASE_URL)
+    elapsed = (time.perf_counter() - started) / repeats
+
+    tracemalloc.start()
+    fn(html, PAGE_URL, BASE_URL)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--links", type=int, default=5000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    html = synthetic_page(args.links)
+    print(f"Page size: {len(html) / 1024:.0f} KiB, {args.links} anchors")
+
+    old, old_time, old_peak = measure(bs4_links, html, args.repeats)
+    new, new_time, new_peak = measure(extract_crawlable_links, html, args.repeats)
+    assert old == new, "extractors disagree"
+
+    print(f"BeautifulSoup: {old_time * 1000:8.1f} ms  peak {old_peak / 2**20:6.1f} MiB")
+    print(f"Streaming:     {new_time * 1000:8.1f} ms  peak {new_peak / 2**20:6.1f} MiB")
+    print(f"Speedup:       {old_time / new_time:8.1f}x")
@@ -1,6 +1,12 @@
+from src.models.crawl import CrawlManifestEntry, FrontierRecord
 from src.models.knowledge import KnowledgeBase, Resource
+from src.models.processing import ProcessedDocument, SummaryCacheEntry
 
 
 def db_init():
     KnowledgeBase.db_init()
     Resource.db_init()
+    CrawlManifestEntry.db_init()
+    FrontierRecord.db_init()
+    ProcessedDocument.db_init()
+    SummaryCacheEntry.db_init()
@@ -0,0 +1,54 @@
+import logging
+import os
+import shutil
+
+from cfg import IO_CONFIG
+from scripts.db_init import db_init
+from src.agents.summarizer import SUMMARIZER_VERSION
+from src.llm_parser import get_all_files_for_processing
+from src.models.processing import DOCUMENT_USELESS, ProcessedDocument
+from src.utils.hashing import content_hash
+from src.utils.loggers import setup_stdout_logging
+
+logger = logging.getLogger(__name__)
+
+LEGACY_USELESS_DIR = os.path.join(IO_CONFIG.storage_dir, "useless")
+
+
+def migrate_useless_markers():
+    if not os.path.isdir(LEGACY_USELESS_DIR):
+        logger.info("No useless marker directory to migrate")
+        return
+
+    # Markers were named after the summary path with "/" mangled to "__."
+    markers = {
+        tuple(marker.replace("__.", "/").split("/")[-2:])
+        for marker in os.listdir(LEGACY_USELESS_DIR)
+    }
+
+    for knowledge_base in sorted({kb for kb, _ in markers}):
+        documents = []
+        for name, page_file in get_all_files_for_processing(knowledge_base):
+            if (knowledge_base, name + ".md") not in markers:
+                continue
+            with open(page_file, "r") as f:
+                page_hash = content_hash(f.read())
+            documents.append(
+                ProcessedDocument(
+                    knowledge_base=knowledge_base,
+                    identifier=name,
+                    content_hash=page_hash,
+                    status=DOCUMENT_USELESS,
+                    prompt_version=SUMMARIZER_VERSION,
+                )
+            )
+        ProcessedDocument.upsert_documents(documents)
+        logger.info(f"Migrated {len(documents)} useless markers for {knowledge_base}")
+
+    shutil.rmtree(LEGACY_USELESS_DIR)
+
+
+if __name__ == "__main__":
+    db_init()
+    setup_stdout_logging()
+    migrate_useless_markers()
@@ -1,17 +1,32 @@
 from agno.agent import Agent  # type: ignore
 from agno.models.google.gemini import Gemini
 from env import GEMINI_API_KEY
-from src.models.knowledge import DiscoveryOutput, KnowledgeBase, Resource
-import os
+from cfg import SEARCH_CONFIG
+from src.models.knowledge import DiscoveryOutput
+from src.search.retrieval import (
+    KNOWLEDGE_BASE_MISSING,
+    RETRIEVAL_ERROR,
+    candidate_prompt_block,
+    format_resource_files,
+    resolve_knowledge_bases,
+)
+import asyncio
 
+# Bounds the Gemini calls in flight across all clients of the server
+llm_semaphore = asyncio.Semaphore(SEARCH_CONFIG.max_llm_searches)
 
-def get_discoverer_response(knowledge_base: str, query: str) -> str:
-    knowledge_base_exists = KnowledgeBase.knowledge_base_exists(knowledge_base)
-    if not knowledge_base_exists:
-        return "Knowledge base does not exist."
 
-    resources = Resource.get_resources_by_knowledge_base(knowledge_base)
-    resource_string = "\n".join([resource.context_string() for resource in resources])
+async def get_discoverer_response(tag: str, query: str) -> str:
+    # Database, index and file work runs in worker threads so the event loop
+    # keeps serving other clients while this query is in progress
+    knowledge_bases = await asyncio.to_thread(resolve_knowledge_bases, tag)
+    if not knowledge_bases:
+        return KNOWLEDGE_BASE_MISSING
+
+    # Only the best retrieval candidates of every matched knowledge base go
+    # into the prompt so its size doesn't grow with the knowledge bases - the
+    # LLM reranks them in a single call
+    resource_string = await candidate_prompt_block(knowledge_bases, query)
 
     agent = Agent(
         model=Gemini(id="gemini-2.0-flash", api_key=GEMINI_API_KEY),
@@ -41,23 +56,14 @@ def get_discoverer_response(knowledge_base: str, query: str) -> str:
         markdown=True,
     )
 
-    response = agent.run("Execute your instructions", retries=3)
+    async with llm_semaphore:
+        response = await agent.arun("Execute your instructions", retries=3)
 
     result: DiscoveryOutput = response.content  # type: ignore
 
     if not isinstance(result, DiscoveryOutput):
-        return "Error retrieving resources"
-
-    return_string = "Here is some extra information that might help inform your responses. Use them as you see fit\n"
-    return_string += "----------------------------------------------------------\n"
-    for file in result.resource_file_paths:
-        if os.path.exists(file):
-            with open(file, "r") as f:
-                content = f.read()
-                return_string += f"File: {file.split('/')[-1]}\nContent:\n{content}\n\n"
-    return_string += "----------------------------------------------------------\n"
+        return RETRIEVAL_ERROR
 
-    if result.additional_comments != "":
-        return_string += f"Additional Comments: {result.additional_comments}\n\n"
-
-    return return_string
+    return await asyncio.to_thread(
+        format_resource_files, result.resource_file_paths, result.additional_comments
+    )
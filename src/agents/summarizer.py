@@ -1,59 +1,255 @@
 from agno.agent import Agent  # type: ignore
 from agno.models.google.gemini import Gemini
 from env import GEMINI_API_KEY
-from src.models.knowledge import LLMResource
+from cfg import PARSER_CONFIG
+from src.models.knowledge import LLMResource, LLMResourceBatch, LLMResourceMerge
+from src.utils.chunking import chunk_markdown
+from src.utils.hashing import content_hash
+from src.utils.rate_limit import LLMRateLimiter, estimate_tokens
+from typing import Callable, Dict, List, Optional, Tuple, Type, TypeVar
+import asyncio
+import json
+import logging
 
+logger = logging.getLogger(__name__)
 
-async def get_summarizer_response(file_content: str, name: str) -> LLMResource:
-    agent = Agent(
-        model=Gemini(id="gemini-2.0-flash", api_key=GEMINI_API_KEY),
-        description="""You are a technical documentation expert that understands complex documentation
-        and converts it to structured data.""",
-        instructions=[
-            "Povided below is a markdown document that was converted from a technical documentation web page.",
-            "Your task is to convert the document to structured data.",
-            "Ignore any strange repeated text or things like nevbars, headers or footers"
-            "Provide a short summary of what is contained in the document,",
-            "a long form cleaned markdown version of the document, and crucially, whether the document is useful",
-            "When determining whether the document is useful, consider the following factors:",
-            "1. Is the core content of the document very short? - if it is, it is not useful",
-            "Reason through it like this: could many of these have been combined into a single document? - if so, it is probably not useful",
-            "2. Does the document convey a major process or concept?",
-            "If e.g. a 'Person' has many 'Jobs', a document that shows how a Person can be created with",
-            "a specific Job, that is not useful (the major concept is the Person - the Job is essentially an argument for the Person)",
-            "This is really important, if no major concept or process is conveyed, the document is not useful",
-            "3. Suppose you were to include the document in a task description, would it add notable value?"
-            "If the answer to this question is something like 'no' or 'not really' or 'kind of' or even 'maybe' - the document is not useful",
-            "For determining whether a document is useful, you should be more reckless than cautious",
-            "4. Could you imagine that this information is available elsewhere in the rest of the documentation?",
-            "If you think it is, the document is not useful",
-            "We are trying to distill the essence of a large corpus of technical documentation and we want to discard as much as possible.",
-            "Any extraneous information must be removed, so only mark it as useful if you deem it absolutely essential and necessary",
-            "NB: if there is any indication that the document is from a different version of an api or sdk, it is not useful",
-            "Changelogs and really long seemingly repetitive information is also not useful",
-            "Any document that is not in english is also immediately not useful",
-            "Here is the document content:",
-            "---------------------",
+ResponseModel = TypeVar(
+    "ResponseModel", LLMResource, LLMResourceMerge, LLMResourceBatch
+)
+
+
+SUMMARIZER_MODEL_ID = "gemini-2.0-flash"
+SUMMARIZER_DESCRIPTION = """You are a technical documentation expert that understands complex documentation
+        and converts it to structured data."""
+
+
+USEFULNESS_CRITERIA = [
+    "When determining whether the document is useful, consider the following factors:",
+    "1. Is the core content of the document very short? - if it is, it is not useful",
+    "Reason through it like this: could many of these have been combined into a single document? - if so, it is probably not useful",
+    "2. Does the document convey a major process or concept?",
+    "If e.g. a 'Person' has many 'Jobs', a document that shows how a Person can be created with",
+    "a specific Job, that is not useful (the major concept is the Person - the Job is essentially an argument for the Person)",
+    "This is really important, if no major concept or process is conveyed, the document is not useful",
+    "3. Suppose you were to include the document in a task description, would it add notable value?"
+    "If the answer to this question is something like 'no' or 'not really' or 'kind of' or even 'maybe' - the document is not useful",
+    "For determining whether a document is useful, you should be more reckless than cautious",
+    "4. Could you imagine that this information is available elsewhere in the rest of the documentation?",
+    "If you think it is, the document is not useful",
+    "We are trying to distill the essence of a large corpus of technical documentation and we want to discard as much as possible.",
+    "Any extraneous information must be removed, so only mark it as useful if you deem it absolutely essential and necessary",
+    "NB: if there is any indication that the document is from a different version of an api or sdk, it is not useful",
+    "Changelogs and really long seemingly repetitive information is also not useful",
+    "Any document that is not in english is also immediately not useful",
+]
+
+
+def _summarizer_instructions(file_content: str, name: str) -> List[str]:
+    return [
+        "Povided below is a markdown document that was converted from a technical documentation web page.",
+        "Your task is to convert the document to structured data.",
+        "Ignore any strange repeated text or things like nevbars, headers or footers"
+        "Provide a short summary of what is contained in the document,",
+        "a long form cleaned markdown version of the document, and crucially, whether the document is useful",
+        *USEFULNESS_CRITERIA,
+        "Here is the document content:",
+        "---------------------",
+        file_content,
+        "---------------------",
+        f"The document originates from {name} (remember to look for version information)",
+        "As a final reminder, remember the fields you need to return are the ('short_description', string), ('long_markdown_summary', string), ('useful', bool)",
+        "Also, remember to condense the information as best you can in the long markdown summary, code examples should be kept (unless there are duplicates or",
+        "the code does not inform any additional information), but paragraphs can be condensed and even removed if they do not add value",
+        "The long markdown summary may not exceed 3000 words due to internal limitations - very important!",
+        "Some documents, e.g. API reference pages, may be very long and while they contain useful information, the could exceed the word limit",
+        "In cases where you think the word limit will be exceeded, see if you can extract the most useful functions and configurations, just try your best",
+    ]
+
+
+def _merge_instructions(name: str, parts: List[LLMResource]) -> List[str]:
+    part_lines = [
+        f"Part {i}: useful={part.useful} - {part.short_description}"
+        for i, part in enumerate(parts, start=1)
+    ]
+    return [
+        f"The document {name} was too long to process at once, so it was split into {len(parts)} parts.",
+        "Each part was summarized separately - below are the short descriptions of the parts and whether each part was judged useful on its own.",
+        "---------------------",
+        *part_lines,
+        "---------------------",
+        "Write one short description for the document as a whole, covering what its parts contain.",
+        "Then decide whether the document as a whole is useful, using the same strict criteria as for a single document:",
+        "it must convey a major process or concept, add notable value to a task description and not be available elsewhere in the documentation.",
+        "Changelogs, documents from other versions of an api or sdk and documents that are not in english are not useful.",
+        "The fields you need to return are ('short_description', string), ('useful', bool)",
+    ]
+
+
+def _batch_instructions(documents: List[Tuple[str, str]]) -> List[str]:
+    document_lines: List[str] = []
+    for name, file_content in documents:
+        document_lines += [
+            f"===== Document {name} =====",
             file_content,
-            "---------------------",
-            f"The document originates from {name} (remember to look for version information)",
-            "As a final reminder, remember the fields you need to return are the ('short_description', string), ('long_markdown_summary', string), ('useful', bool)",
-            "Also, remember to condense the information as best you can in the long markdown summary, code examples should be kept (unless there are duplicates or",
-            "the code does not inform any additional information), but paragraphs can be condensed and even removed if they do not add value",
-            "The long markdown summary may not exceed 3000 words due to internal limitations - very important!",
-            "Some documents, e.g. API reference pages, may be very long and while they contain useful information, the could exceed the word limit",
-            "In cases where you think the word limit will be exceeded, see if you can extract the most useful functions and configurations, just try your best",
-        ],
+            f"===== End of document {name} =====",
+        ]
+    return [
+        f"Provided below are {len(documents)} markdown documents that were converted from technical documentation web pages.",
+        "Your task is to convert every document to structured data, each one independently of the others.",
+        "Ignore any strange repeated text or things like navbars, headers or footers",
+        "For every document provide a short summary of what is contained in it,",
+        "a long form cleaned markdown version of it, and crucially, whether it is useful",
+        *USEFULNESS_CRITERIA,
+        "Judge every document on its own, appearing in the same batch says nothing about how useful the documents are",
+        "Here are the documents, each one is delimited by its identifier (remember to look for version information in the identifiers):",
+        *document_lines,
+        "Return exactly one entry in 'resources' per document, with ('identifier', string) set to the identifier of the document exactly as given above,",
+        "and ('short_description', string), ('long_markdown_summary', string), ('useful', bool) filled in as for a single document",
+        "Remember to condense the information as best you can in the long markdown summaries, code examples should be kept but paragraphs can be condensed",
+        "Each long markdown summary may not exceed 3000 words due to internal limitations - very important!",
+    ]
+
+
+# Changes whenever the model, the prompt templates (including the batch one), the output schemas or the
+# chunking budget change, so cached summaries from an older prompt are never reused
+SUMMARIZER_VERSION = content_hash(
+    "\n".join(
+        [
+            SUMMARIZER_MODEL_ID,
+            SUMMARIZER_DESCRIPTION,
+            *_summarizer_instructions("{file_content}", "{name}"),
+            *_merge_instructions("{name}", []),
+            *_batch_instructions([("{name}", "{file_content}")]),
+            json.dumps(LLMResource.model_json_schema(), sort_keys=True),
+            json.dumps(LLMResourceMerge.model_json_schema(), sort_keys=True),
+            json.dumps(LLMResourceBatch.model_json_schema(), sort_keys=True),
+            str(PARSER_CONFIG.max_document_tokens),
+        ]
+    )
+)[:16]
+
+
+async def _run_agent(
+    instructions: List[str],
+    response_model: Type[ResponseModel],
+    limiter: Optional[LLMRateLimiter],
+) -> ResponseModel:
+    agent = Agent(
+        model=Gemini(id=SUMMARIZER_MODEL_ID, api_key=GEMINI_API_KEY),
+        description=SUMMARIZER_DESCRIPTION,
+        instructions=instructions,
         structured_outputs=True,
-        response_model=LLMResource,
+        response_model=response_model,
         markdown=True,
         # debug_mode=True,
     )
 
-    response = await agent.arun("Execute your instructions", retries=3)
-    result: LLMResource = response.content
+    if limiter is not None:
+        await limiter.acquire(estimate_tokens("\n".join(instructions)))
+
+    # No retries inside agno - the parser retries failed documents itself, and
+    # every one of its attempts goes through the rate limiter
+    response = await agent.arun("Execute your instructions", retries=0)
+    result = response.content
 
-    if not isinstance(result, LLMResource):
+    if not isinstance(result, response_model):
         raise ValueError("Invalid response")
 
     return result
+
+
+async def get_summarizer_response(
+    file_content: str,
+    name: str,
+    limiter: Optional[LLMRateLimiter] = None,
+    max_tokens: int = PARSER_CONFIG.max_document_tokens,
+) -> LLMResource:
+    chunks = chunk_markdown(file_content, max_tokens)
+    if len(chunks) <= 1:
+        return await _run_agent(
+            _summarizer_instructions(file_content, name), LLMResource, limiter
+        )
+
+    # Map: summarize heading aligned chunks concurrently, reduce: merge the
+    # partial results into a single resource
+    logger.info(f"Summarizing {name} in {len(chunks)} parts")
+    semaphore = asyncio.Semaphore(PARSER_CONFIG.max_chunk_concurrency)
+
+    async def summarize_part(i: int, chunk: str) -> LLMResource:
+        async with semaphore:
+            return await _run_agent(
+                _summarizer_instructions(chunk, f"{name} (part {i} of {len(chunks)})"),
+                LLMResource,
+                limiter,
+            )
+
+    parts = await asyncio.gather(
+        *[summarize_part(i, chunk) for i, chunk in enumerate(chunks, start=1)]
+    )
+    merged = await _run_agent(
+        _merge_instructions(name, parts), LLMResourceMerge, limiter
+    )
+    useful_parts = [part for part in parts if part.useful] or parts
+
+    return LLMResource(
+        short_description=merged.short_description,
+        long_markdown_summary="\n\n".join(
+            part.long_markdown_summary for part in useful_parts
+        ),
+        useful=merged.useful,
+    )
+
+
+async def get_batch_summarizer_response(
+    documents: List[Tuple[str, str]],
+    limiter: Optional[LLMRateLimiter] = None,
+    on_results: Optional[Callable[[Dict[str, LLMResource]], None]] = None,
+) -> Dict[str, LLMResource]:
+    # Only documents that were summarized are returned, a missing document
+    # failed and is left to the caller to retry. on_results gets results as
+    # soon as they arrive so they are kept even if other documents fail
+    results: Dict[str, LLMResource] = {}
+
+    def deliver(new_results: Dict[str, LLMResource]) -> None:
+        if new_results and on_results is not None:
+            on_results(new_results)
+        results.update(new_results)
+
+    if len(documents) > 1:
+        # Small documents share one request so the fixed instructions are
+        # only paid for once - anything the batch response does not cover is
+        # retried with a single document call
+        names = {name for name, _ in documents}
+        batch_results: Dict[str, LLMResource] = {}
+        try:
+            batch = await _run_agent(
+                _batch_instructions(documents), LLMResourceBatch, limiter
+            )
+            for resource in batch.resources:
+                if resource.identifier in names:
+                    batch_results.setdefault(
+                        resource.identifier,
+                        LLMResource(**resource.model_dump(exclude={"identifier"})),
+                    )
+        except ValueError as e:
+            logger.warning(f"Could not parse batch of {len(documents)} documents: {e}")
+        deliver(batch_results)
+
+    missing = [(name, content) for name, content in documents if name not in results]
+    if len(documents) > 1 and missing:
+        logger.info(
+            f"Falling back to single calls for {len(missing)} of {len(documents)} batched documents"
+        )
+
+    async def summarize_single(name: str, content: str) -> None:
+        deliver({name: await get_summarizer_response(content, name, limiter)})
+
+    outcomes = await asyncio.gather(
+        *[summarize_single(name, content) for name, content in missing],
+        return_exceptions=True,
+    )
+    for (name, _), outcome in zip(missing, outcomes):
+        if isinstance(outcome, Exception):
+            logger.warning(f"Could not summarize {name}: {outcome}")
+
+    return results
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from cfg import CRAWL_CONFIG
+from src.crawler.urls import VisitedSet, canonicalize_url
+from src.models.crawl import (
+    FRONTIER_DONE,
+    FRONTIER_FAILED,
+    FRONTIER_IN_FLIGHT,
+    FRONTIER_PENDING,
+    FrontierRecord,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class FrontierEntry:
+    url: str
+    key: str
+    depth: int
+    max_depth: int
+    lastmod: Optional[datetime] = None
+    retries: int = 0
+
+
+class CrawlFrontier:
+    def __init__(
+        self,
+        knowledge_base: str,
+        max_retries: int = CRAWL_CONFIG.max_retries,
+        retry_base_delay: float = CRAWL_CONFIG.retry_base_delay,
+    ):
+        self.knowledge_base = knowledge_base
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.queue: asyncio.Queue[FrontierEntry] = asyncio.Queue()
+        self.visited = VisitedSet()
+        self.retry_tasks: set[asyncio.Task] = set()
+
+    def restore(self) -> bool:
+        records = FrontierRecord.get_frontier(self.knowledge_base)
+        resumable = [
+            r
+            for r in records
+            if r.state in (FRONTIER_PENDING, FRONTIER_IN_FLIGHT)
+            or (r.state == FRONTIER_FAILED and r.retries < self.max_retries)
+        ]
+        if not resumable:
+            # The previous crawl ran to completion - start a fresh one
+            FrontierRecord.clear_frontier(self.knowledge_base)
+            return False
+
+        for r in records:
+            self.visited.add(r.key, r.max_depth - r.depth)
+        for r in resumable:
+            entry = FrontierEntry(
+                url=r.url,
+                key=r.key,
+                depth=r.depth,
+                max_depth=r.max_depth,
+                lastmod=datetime.fromisoformat(r.lastmod) if r.lastmod else None,
+                retries=r.retries,
+            )
+            if r.state == FRONTIER_FAILED:
+                # Failed urls wait out their backoff again instead of hitting
+                # the host that just failed as the first thing of the resume
+                self._schedule_retry(entry, self._retry_delay(entry.retries))
+                continue
+            if r.state != FRONTIER_PENDING:
+                FrontierRecord.set_state(self.knowledge_base, r.key, FRONTIER_PENDING)
+            self.queue.put_nowait(entry)
+        logger.info(
+            f"Resuming crawl of {self.knowledge_base} with {len(resumable)} of {len(records)} urls left"
+        )
+        return True
+
+    def _new_entry(
+        self, url: str, depth: int, max_depth: int, lastmod: Optional[datetime]
+    ) -> Optional[FrontierEntry]:
+        if depth > max_depth:
+            return None
+        # A url reached again with more depth left is queued again so its
+        # links get followed with the larger budget - e.g. a page that came
+        # from the sitemap first and is later found by the base crawl
+        key = canonicalize_url(url)
+        if not self.visited.add(key, max_depth - depth):
+            return None
+        return FrontierEntry(
+            url=url, key=key, depth=depth, max_depth=max_depth, lastmod=lastmod
+        )
+
+    def _enqueue(self, entries: List[FrontierEntry]) -> None:
+        FrontierRecord.insert_records(
+            [
+                FrontierRecord(
+                    knowledge_base=self.knowledge_base,
+                    key=e.key,
+                    url=e.url,
+                    depth=e.depth,
+                    max_depth=e.max_depth,
+                    lastmod=e.lastmod.isoformat() if e.lastmod else None,
+                )
+                for e in entries
+            ]
+        )
+        for entry in entries:
+            self.queue.put_nowait(entry)
+
+    def push(
+        self,
+        url: str,
+        depth: int,
+        max_depth: int,
+        lastmod: Optional[datetime] = None,
+    ) -> bool:
+        entry = self._new_entry(url, depth, max_depth, lastmod)
+        if entry is None:
+            return False
+        self._enqueue([entry])
+        return True
+
+    def push_children(self, parent: FrontierEntry, links: Iterable[str]) -> None:
+        entries = [
+            self._new_entry(link, parent.depth + 1, parent.max_depth, None)
+            for link in links
+        ]
+        self._enqueue([e for e in entries if e is not None])
+
+    async def pop(self) -> FrontierEntry:
+        while True:
+            entry = await self.queue.get()
+            if entry.max_depth - entry.depth < (self.visited.budget(entry.key) or 0):
+                # Superseded by an entry with a larger budget, queued as well
+                self.queue.task_done()
+                continue
+            self._set_state(entry, FRONTIER_IN_FLIGHT)
+            return entry
+
+    def _set_state(self, entry: FrontierEntry, state: str, **kwargs) -> None:
+        # The frontier state is only needed to resume, a failed write is logged
+        # so the worker keeps running and the queue accounting stays intact
+        try:
+            FrontierRecord.set_state(self.knowledge_base, entry.key, state, **kwargs)
+        except Exception as e:
+            logger.error(f"Could not persist state {state} of {entry.url}: {e}")
+
+    def complete(self, entry: FrontierEntry, links: Iterable[str]) -> None:
+        try:
+            self.push_children(entry, links)
+        except Exception as e:
+            logger.error(f"Could not queue the links of {entry.url}: {e}")
+        finally:
+            self._set_state(entry, FRONTIER_DONE)
+            self.queue.task_done()
+
+    def fail(
+        self, entry: FrontierEntry, error: str, retry_after: Optional[float] = None
+    ) -> None:
+        try:
+            entry.retries += 1
+            self._set_state(
+                entry, FRONTIER_FAILED, retries=entry.retries, last_error=error
+            )
+            if entry.retries >= self.max_retries:
+                logger.error(f"Giving up on {entry.url} after {entry.retries} attempts")
+                return
+            delay = self._retry_delay(entry.retries, retry_after)
+            logger.info(f"Retrying {entry.url} in {delay:.1f}s")
+            self._schedule_retry(entry, delay)
+        finally:
+            self.queue.task_done()
+
+    def _retry_delay(self, retries: int, retry_after: Optional[float] = None) -> float:
+        delay = self.retry_base_delay * 2 ** (max(retries, 1) - 1)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def _schedule_retry(self, entry: FrontierEntry, delay: float) -> None:
+        task = asyncio.create_task(self._requeue_later(entry, delay))
+        self.retry_tasks.add(task)
+        task.add_done_callback(self.retry_tasks.discard)
+
+    async def _requeue_later(self, entry: FrontierEntry, delay: float) -> None:
+        await asyncio.sleep(delay)
+        self._set_state(entry, FRONTIER_PENDING)
+        self.queue.put_nowait(entry)
+
+    async def join(self) -> None:
+        # Entries waiting out a backoff are not in the queue, so the frontier
+        # is only drained once the queue is empty and no retry is pending
+        while True:
+            await self.queue.join()
+            if not self.retry_tasks:
+                return
+            await asyncio.wait(list(self.retry_tasks))
+
+    def close(self) -> None:
+        for task in list(self.retry_tasks):
+            task.cancel()
@@ -0,0 +1,46 @@
+from html.parser import HTMLParser
+from typing import List
+from urllib.parse import urljoin, urlsplit
+
+CRAWLABLE_SUFFIXES = (".html", ".md")
+
+
+class AnchorHrefParser(HTMLParser):
+    # Only looks at <a> start tags - no tree is built, so memory stays flat
+    # no matter how large the page is
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.hrefs: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "a":
+            return
+        for name, value in attrs:
+            if name == "href" and value:
+                self.hrefs.append(value)
+                return
+
+
+def extract_hrefs(html: str) -> List[str]:
+    parser = AnchorHrefParser()
+    parser.feed(html)
+    parser.close()
+    return parser.hrefs
+
+
+def is_crawlable(link: str, base_url: str) -> bool:
+    # Only crawl links that start with base URL and end with .html or / or .md
+    # or have no extension (are not a file)
+    if not link.startswith(base_url):
+        return False
+    path = urlsplit(link).path
+    return path.endswith(CRAWLABLE_SUFFIXES) or "." not in path.rsplit("/", 1)[-1]
+
+
+def extract_crawlable_links(html: str, page_url: str, base_url: str) -> List[str]:
+    links = set()
+    for href in extract_hrefs(html):
+        link = urljoin(page_url, href).split("#")[0]
+        if is_crawlable(link, base_url):
+            links.add(link)
+    return sorted(links)
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Dict, Optional
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+
+from cfg import CRAWL_CONFIG
+from src.utils.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_STATUS_CODES = (429, 503)
+
+
+class RateLimited(Exception):
+    def __init__(self, url: str, status_code: int, retry_after: Optional[float]):
+        super().__init__(f"{url} answered {status_code} (retry after {retry_after})")
+        self.url = url
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def host_of(url: str) -> str:
+    return (urlsplit(url).hostname or "").lower()
+
+
+class HostState:
+    def __init__(self, requests_per_second: float, concurrency: int):
+        self.bucket = TokenBucket(requests_per_second, max(1.0, requests_per_second))
+        self.limit = float(concurrency)
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+        self.blocked_until = 0.0
+        self.latency_ewma: Optional[float] = None
+        self.baseline_latency: Optional[float] = None
+        self.latency_samples = 0
+        self.slow_streak = 0
+        self.successes = 0
+        self.throttled = 0
+        self.errors = 0
+
+
+class HostScheduler:
+    # Token bucket per host plus an AIMD concurrency limit: the limit grows by
+    # one after a full window of healthy responses and is cut on throttling,
+    # errors or a sustained rise of the recent latency far above the host's
+    # long-run latency
+    def __init__(
+        self,
+        requests_per_second: float = CRAWL_CONFIG.host_requests_per_second,
+        initial_concurrency: int = CRAWL_CONFIG.host_initial_concurrency,
+        max_concurrency: int = CRAWL_CONFIG.host_max_concurrency,
+        latency_factor: float = CRAWL_CONFIG.host_latency_factor,
+        slow_samples: int = CRAWL_CONFIG.host_slow_samples,
+    ):
+        self.requests_per_second = requests_per_second
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_factor = latency_factor
+        self.slow_samples = slow_samples
+        self.hosts: Dict[str, HostState] = {}
+
+    def _state(self, host: str) -> HostState:
+        if host not in self.hosts:
+            self.hosts[host] = HostState(
+                self.requests_per_second, self.initial_concurrency
+            )
+        return self.hosts[host]
+
+    def apply_robots(self, base_url: str, robots: Optional[RobotFileParser]) -> None:
+        if robots is None:
+            return
+        delay = robots.crawl_delay("*")
+        if not delay:
+            return
+        state = self._state(host_of(base_url))
+        rate = min(state.bucket.rate, 1.0 / float(delay))
+        state.bucket.set_rate(rate)
+        logger.info(f"Honoring Crawl-delay {delay}s for {host_of(base_url)}")
+
+    @asynccontextmanager
+    async def slot(self, url: str) -> AsyncIterator[None]:
+        state = self._state(host_of(url))
+        async with state.condition:
+            await state.condition.wait_for(lambda: state.in_flight < int(state.limit))
+            state.in_flight += 1
+        try:
+            blocked_for = state.blocked_until - time.monotonic()
+            if blocked_for > 0:
+                await asyncio.sleep(blocked_for)
+            await state.bucket.acquire()
+            yield
+        finally:
+            async with state.condition:
+                state.in_flight -= 1
+                state.condition.notify_all()
+
+    def _decrease(self, host: str, state: HostState, factor: float) -> None:
+        state.limit = max(1.0, state.limit * factor)
+        state.successes = 0
+        state.slow_streak = 0
+        logger.info(
+            f"Lowered concurrency for {host} to {int(state.limit)} "
+            f"({state.throttled} throttled, {state.errors} failed so far)"
+        )
+
+    async def record(
+        self,
+        url: str,
+        latency: Optional[float],
+        status_code: Optional[int],
+        retry_after: Optional[float] = None,
+    ) -> None:
+        host = host_of(url)
+        state = self._state(host)
+
+        if status_code in THROTTLE_STATUS_CODES:
+            state.throttled += 1
+            if retry_after:
+                state.blocked_until = max(
+                    state.blocked_until, time.monotonic() + retry_after
+                )
+            self._decrease(host, state, 0.5)
+            return
+        if status_code is None or status_code >= 500:
+            state.errors += 1
+            self._decrease(host, state, 0.75)
+            return
+        # Requests that aren't comparable to page renders only report status
+        if latency is None:
+            await self._succeed(state)
+            return
+
+        state.latency_ewma = (
+            latency
+            if state.latency_ewma is None
+            else 0.8 * state.latency_ewma + 0.2 * latency
+        )
+        # The baseline is a plain average until it has enough samples and a
+        # slow moving average after, so it follows the host's normal latency
+        # without being pinned to a single lucky response
+        state.latency_samples += 1
+        weight = max(0.02, 1.0 / state.latency_samples)
+        state.baseline_latency = (
+            latency
+            if state.baseline_latency is None
+            else (1 - weight) * state.baseline_latency + weight * latency
+        )
+        if state.latency_ewma > self.latency_factor * state.baseline_latency:
+            state.slow_streak += 1
+            if state.slow_streak >= self.slow_samples:
+                self._decrease(host, state, 0.9)
+            return
+        state.slow_streak = 0
+        await self._succeed(state)
+
+    async def _succeed(self, state: HostState) -> None:
+        state.successes += 1
+        if state.successes >= state.limit and state.limit < self.max_concurrency:
+            state.limit = min(float(self.max_concurrency), state.limit + 1)
+            state.successes = 0
+            async with state.condition:
+                state.condition.notify_all()
@@ -0,0 +1,28 @@
+from dataclasses import dataclass
+from typing import List, Optional
+
+from src.crawler.links import extract_crawlable_links
+from src.utils.hashing import content_hash
+
+
+@dataclass
+class ProcessedPage:
+    markdown: Optional[str]
+    content_hash: Optional[str]
+    links: List[str]
+
+
+def is_empty_page(markdown: str) -> bool:
+    return not markdown or "404" in markdown and len(markdown) < 500
+
+
+def process_page(url: str, html: str, markdown: str, base_url: str) -> ProcessedPage:
+    # Runs inside worker processes when CRAWL_CONFIG.process_workers > 0, so it
+    # must stay a plain module level function over picklable arguments
+    links = extract_crawlable_links(html or "", url, base_url)
+    if is_empty_page(markdown):
+        return ProcessedPage(markdown=None, content_hash=None, links=links)
+    markdown = markdown.strip()
+    return ProcessedPage(
+        markdown=markdown, content_hash=content_hash(markdown), links=links
+    )
@@ -0,0 +1,27 @@
+import logging
+from typing import Optional
+from urllib.parse import urljoin
+from urllib.robotparser import RobotFileParser
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+async def fetch_robots(
+    client: httpx.AsyncClient, base_url: str
+) -> Optional[RobotFileParser]:
+    robots_url = urljoin(base_url, "/robots.txt")
+    try:
+        response = await client.get(robots_url)
+    except httpx.HTTPError as e:
+        logger.warning(f"Error fetching robots.txt from {robots_url}: {e}")
+        return None
+
+    if response.status_code != 200:
+        logger.info(f"No robots.txt at {robots_url} ({response.status_code})")
+        return None
+
+    robots = RobotFileParser(robots_url)
+    robots.parse(response.text.splitlines())
+    return robots
@@ -0,0 +1,143 @@
+import logging
+import xml.etree.ElementTree as ET
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+from urllib.parse import urljoin
+from urllib.robotparser import RobotFileParser
+
+import httpx
+
+from cfg import CRAWL_CONFIG
+
+logger = logging.getLogger(__name__)
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+@dataclass
+class SitemapEntry:
+    loc: str
+    lastmod: Optional[datetime] = None
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_lastmod(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip())
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+class SitemapStreamParser:
+    def __init__(self):
+        self.parser = ET.XMLPullParser(events=("start", "end"))
+        self.decompressor = None
+        self.sniffed = False
+        self.root: Optional[ET.Element] = None
+
+    def feed(self, chunk: bytes) -> Iterator[Tuple[str, SitemapEntry]]:
+        if not self.sniffed:
+            # .xml.gz sitemaps are usually served as raw gzip bytes, not with a
+            # Content-Encoding header, so httpx hands them over still compressed
+            self.sniffed = True
+            if chunk.startswith(GZIP_MAGIC):
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self.decompressor is not None:
+            chunk = self.decompressor.decompress(chunk)
+        self.parser.feed(chunk)
+        return self._read_entries()
+
+    def close(self) -> Iterator[Tuple[str, SitemapEntry]]:
+        if self.decompressor is not None:
+            self.parser.feed(self.decompressor.flush())
+        self.parser.close()
+        return self._read_entries()
+
+    def _read_entries(self) -> Iterator[Tuple[str, SitemapEntry]]:
+        for event, elem in self.parser.read_events():
+            if event == "start":
+                if self.root is None:
+                    self.root = elem
+                continue
+
+            kind = _local_name(elem.tag)
+            if kind not in ("url", "sitemap"):
+                continue
+
+            loc, lastmod = None, None
+            for child in elem:
+                name = _local_name(child.tag)
+                if name == "loc":
+                    loc = (child.text or "").strip()
+                elif name == "lastmod":
+                    lastmod = child.text
+
+            # Drop everything parsed so far so huge sitemaps stay flat in memory
+            if self.root is not None:
+                self.root.clear()
+
+            if loc:
+                yield kind, SitemapEntry(loc=loc, lastmod=parse_lastmod(lastmod))
+
+
+async def _stream_sitemap(
+    client: httpx.AsyncClient, sitemap_url: str
+) -> AsyncIterator[Tuple[str, SitemapEntry]]:
+    parser = SitemapStreamParser()
+    try:
+        async with client.stream("GET", sitemap_url) as response:
+            if response.status_code != 200:
+                logger.warning(
+                    f"Failed to fetch sitemap from {sitemap_url} ({response.status_code})"
+                )
+                return
+            async for chunk in response.aiter_bytes():
+                for item in parser.feed(chunk):
+                    yield item
+        for item in parser.close():
+            yield item
+    except (httpx.HTTPError, ET.ParseError, zlib.error) as e:
+        logger.error(f"Error reading sitemap from {sitemap_url}: {e}")
+
+
+def sitemap_candidates(base_url: str, robots: Optional[RobotFileParser]) -> List[str]:
+    declared = robots.site_maps() if robots is not None else None
+    if declared:
+        return list(declared)
+    return [urljoin(base_url, "/sitemap.xml")]
+
+
+async def iter_sitemap_entries(
+    client: httpx.AsyncClient,
+    base_url: str,
+    robots: Optional[RobotFileParser] = None,
+    max_sitemaps: int = CRAWL_CONFIG.max_sitemaps,
+) -> AsyncIterator[SitemapEntry]:
+    pending = sitemap_candidates(base_url, robots)
+    fetched: set[str] = set()
+
+    while pending and len(fetched) < max_sitemaps:
+        sitemap_url = pending.pop()
+        if sitemap_url in fetched:
+            continue
+        fetched.add(sitemap_url)
+        logger.info(f"Reading sitemap {sitemap_url}")
+
+        async for kind, entry in _stream_sitemap(client, sitemap_url):
+            if kind == "sitemap":
+                pending.append(entry.loc)
+            else:
+                yield entry
+
+    if pending:
+        logger.warning(f"Stopped after {max_sitemaps} sitemaps for {base_url}")
@@ -0,0 +1,73 @@
+import hashlib
+import re
+from typing import Optional
+from urllib.parse import parse_qsl, quote, unquote, urlencode, urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+INDEX_PAGE_RE = re.compile(r"/index\.(html?|php|md)$", re.IGNORECASE)
+DUPLICATE_SLASHES_RE = re.compile(r"/{2,}")
+TRACKING_PARAMS = {"ref", "fbclid", "gclid"}
+
+
+def _is_tracking_param(key: str) -> bool:
+    key = key.lower()
+    return key.startswith("utm_") or key in TRACKING_PARAMS
+
+
+def canonicalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    port = parts.port
+    netloc = host if port is None or DEFAULT_PORTS.get(scheme) == port else f"{host}:{port}"
+
+    path = DUPLICATE_SLASHES_RE.sub("/", parts.path or "/")
+    path = INDEX_PAGE_RE.sub("/", path)
+    path = quote(unquote(path), safe="/:@!$&'()*+,;=~")
+    path = path.rstrip("/") or "/"
+
+    query = urlencode(
+        sorted(
+            (key, value)
+            for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if not _is_tracking_param(key)
+        )
+    )
+
+    # Documentation hosts serve paths case-insensitively often enough that
+    # folding them is worth the (rare) false merge
+    return urlunsplit((scheme, netloc, path.lower(), query, ""))
+
+
+def url_fingerprint(canonical_url: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(canonical_url.encode("utf-8"), digest_size=8).digest(), "big"
+    )
+
+
+class VisitedSet:
+    # Keeps 64 bit fingerprints instead of url strings - collisions are
+    # negligible at crawl sizes and memory stays flat per url. Every url
+    # remembers the largest depth budget (max_depth - depth) it was reached with
+    __slots__ = ("_budgets",)
+
+    def __init__(self):
+        self._budgets: dict[int, int] = {}
+
+    def add(self, canonical_url: str, budget: int = 0) -> bool:
+        # True when the url is new or was reached with more budget than before
+        fingerprint = url_fingerprint(canonical_url)
+        known = self._budgets.get(fingerprint)
+        if known is not None and known >= budget:
+            return False
+        self._budgets[fingerprint] = budget
+        return True
+
+    def budget(self, canonical_url: str) -> Optional[int]:
+        return self._budgets.get(url_fingerprint(canonical_url))
+
+    def __contains__(self, canonical_url: str) -> bool:
+        return url_fingerprint(canonical_url) in self._budgets
+
+    def __len__(self) -> int:
+        return len(self._budgets)
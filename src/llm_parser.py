@@ -1,20 +1,43 @@
 import os
 from agents import summarizer
-from agents.summarizer import get_summarizer_response
-from cfg import IO_CONFIG
+from agents.summarizer import SUMMARIZER_VERSION, get_batch_summarizer_response
+from cfg import IO_CONFIG, PARSER_CONFIG
 from scripts.db_init import db_init
 from utils.loggers import setup_stdout_logging
 from env import GEMINI_API_KEY
-from typing import Tuple, List
+from typing import Dict, Optional, Tuple, List
+from src.models.jobs import JobsConfig
 from src.models.knowledge import KnowledgeBase, LLMResource, Resource
+from src.models.processing import (
+    DOCUMENT_DUPLICATE,
+    DOCUMENT_SUMMARIZED,
+    DOCUMENT_USELESS,
+    ProcessedDocument,
+    SummaryCacheEntry,
+)
+from src.utils.dedup import NearDuplicateIndex, simhash
+from src.utils.hashing import content_hash
+from src.utils.rate_limit import LLMRateLimiter
+from dataclasses import dataclass
 import asyncio
-import math
+import random
 
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def page_identifier(knowledge_base: str, page_file: str) -> str:
+    source_documents_dir = os.path.join(IO_CONFIG.docs_dir, knowledge_base)
+    return (
+        page_file.replace(source_documents_dir, "")
+        .replace("/page.md", "")
+        .replace(".html", "")
+        .lstrip("/")
+        .replace("/", "|")
+    )
+
+
 def get_all_files_for_processing(knowledge_base):
     logger.info(f"Getting all files for processing from {knowledge_base}")
     names_files = []
@@ -24,73 +47,369 @@ def get_all_files_for_processing(knowledge_base):
             if filename.endswith(".md"):
                 page_file = os.path.join(root, filename)
                 names_files.append(
-                    (
-                        page_file.replace(source_documents_dir, "")
-                        .replace("/page.md", "")
-                        .replace(".html", "")
-                        .lstrip("/")
-                        .replace("/", "|"),
-                        page_file,
-                    )
+                    (page_identifier(knowledge_base, page_file), page_file)
                 )
     return names_files
 
 
-async def process_file(
-    knowledge_base: str, name_file: Tuple[str, str], force: bool = False
-):
-    useless_files = [f.replace("__.", "/") for f in os.listdir(IO_CONFIG.useless_dir)]
+@dataclass
+class ParseSession:
+    knowledge_base: str
+    force: bool
+    limiter: LLMRateLimiter
+    documents: Dict[str, ProcessedDocument]
+
+
+def new_parse_session(
+    knowledge_base: str, force: bool = False, limiter: Optional[LLMRateLimiter] = None
+) -> ParseSession:
+    return ParseSession(
+        knowledge_base=knowledge_base,
+        force=force,
+        limiter=limiter
+        or LLMRateLimiter(
+            PARSER_CONFIG.requests_per_minute, PARSER_CONFIG.tokens_per_minute
+        ),
+        documents=ProcessedDocument.get_documents(knowledge_base),
+    )
+
+
+def _processed_document(
+    session: ParseSession, name: str, page_hash: str, status: str
+) -> ProcessedDocument:
+    return ProcessedDocument(
+        knowledge_base=session.knowledge_base,
+        identifier=name,
+        content_hash=page_hash,
+        status=status,
+        prompt_version=SUMMARIZER_VERSION,
+    )
+
+
+def _record_documents(session: ParseSession, documents: List[ProcessedDocument]):
+    ProcessedDocument.upsert_documents(documents)
+    for document in documents:
+        session.documents[document.identifier] = document
+
+
+def _record_document(
+    session: ParseSession, name: str, page_hash: str, status: str
+) -> None:
+    _record_documents(session, [_processed_document(session, name, page_hash, status)])
+
+
+def check_duplicate(
+    index: NearDuplicateIndex,
+    knowledge_base: str,
+    name: str,
+    file: str,
+    min_words: int = PARSER_CONFIG.dedup_min_words,
+) -> Optional[ProcessedDocument]:
+    with open(file, "r") as f:
+        file_content = f.read()
+    fingerprint = simhash(file_content, min_words=min_words)
+    representative = index.add(name, fingerprint) if fingerprint is not None else None
+    if representative is None:
+        return None
+    logger.info(f"{name} is a near duplicate of {representative}")
+    return ProcessedDocument(
+        knowledge_base=knowledge_base,
+        identifier=name,
+        content_hash=content_hash(file_content),
+        status=DOCUMENT_DUPLICATE,
+    )
+
+
+def deduplicate_files(
+    knowledge_base: str,
+    files: List[Tuple[str, str]],
+    max_distance: int = PARSER_CONFIG.dedup_max_distance,
+    min_words: int = PARSER_CONFIG.dedup_min_words,
+) -> Tuple[List[Tuple[str, str]], List[ProcessedDocument]]:
+    index = NearDuplicateIndex(max_distance=max_distance)
+    representatives: List[Tuple[str, str]] = []
+    duplicates: List[ProcessedDocument] = []
+
+    # Shortest identifiers first so the unversioned / canonical copy of a page
+    # is the one that represents its cluster
+    for name, file in sorted(files, key=lambda nf: (len(nf[0]), nf[0])):
+        duplicate = check_duplicate(index, knowledge_base, name, file, min_words)
+        if duplicate is None:
+            representatives.append((name, file))
+        else:
+            duplicates.append(duplicate)
+
+    return representatives, duplicates
+
+
+def summary_cache_key(name: str, page_hash: str) -> str:
+    # The prompt contains the document name, so the same page under another
+    # name gets its own cache entry
+    return content_hash(f"{name}\n{page_hash}")
+
+
+@dataclass
+class PendingDocument:
+    name: str
+    file_content: str
+    page_hash: str
+    summary_file_path: str
+
+
+def _finalize_documents(
+    session: ParseSession, finalized: List[Tuple[PendingDocument, LLMResource]]
+) -> None:
+    # The documents of a batch are written together, one transaction for the
+    # resources and one for the registry instead of two per document
+    resources: List[Resource] = []
+    summaries: Dict[str, str] = {}
+    page_markdowns: Dict[str, str] = {}
+    documents: List[ProcessedDocument] = []
+    for pending, agent_response in finalized:
+        name = pending.name
+        if not agent_response.useful:
+            logger.info(f"Useless file {name}...")
+            documents.append(
+                _processed_document(session, name, pending.page_hash, DOCUMENT_USELESS)
+            )
+            continue
 
+        with open(pending.summary_file_path, "w") as f:
+            f.write(agent_response.long_markdown_summary)
+
+        resources.append(
+            Resource(
+                knowledge_base=session.knowledge_base,
+                identifier=name,
+                summary_file_path=pending.summary_file_path,
+                short_description=agent_response.short_description,
+            )
+        )
+        summaries[name] = agent_response.long_markdown_summary
+        page_markdowns[name] = pending.file_content
+        documents.append(
+            _processed_document(session, name, pending.page_hash, DOCUMENT_SUMMARIZED)
+        )
+
+    if resources:
+        Resource.upsert_resources(resources, page_markdowns, summaries)
+    if documents:
+        _record_documents(session, documents)
+
+
+def _prepare_document(
+    session: ParseSession, name_file: Tuple[str, str]
+) -> Optional[PendingDocument]:
+    # Returns the document if it still needs summarizing, skipped documents
+    # are fully handled here
     name, file = name_file
-    summary_dir = os.path.join(IO_CONFIG.summaries_dir, knowledge_base)
+    summary_dir = os.path.join(IO_CONFIG.summaries_dir, session.knowledge_base)
     os.makedirs(summary_dir, exist_ok=True)
     summary_file_path = os.path.join(summary_dir, name + ".md")
-    if os.path.exists(summary_file_path) and not force:
-        logger.info(f"Skipping file {name}...")
-        return
-
-    if summary_file_path in useless_files:
-        logger.info(f"Skipping prev useless file {name}...")
-        return
 
-    logger.info(f"Processing file {name}...")
     with open(file, "r") as f:
         file_content = f.read()
+    page_hash = content_hash(file_content)
 
-    agent_response = await get_summarizer_response(file_content, name)
+    known = session.documents.get(name)
+    if not session.force:
+        if known is None and os.path.exists(summary_file_path):
+            # Summarized before the registry existed - adopt it as is
+            logger.info(f"Skipping file {name}...")
+            _record_document(session, name, page_hash, DOCUMENT_SUMMARIZED)
+            return None
+        # A bumped prompt or model re-summarizes unchanged pages as well
+        if (
+            known is not None
+            and known.content_hash == page_hash
+            and known.prompt_version == SUMMARIZER_VERSION
+        ):
+            if known.status == DOCUMENT_USELESS:
+                logger.info(f"Skipping prev useless file {name}...")
+                return None
+            if os.path.exists(summary_file_path):
+                logger.info(f"Skipping unchanged file {name}...")
+                return None
 
-    if not agent_response.useful:
-        useless_file = os.path.join(
-            IO_CONFIG.useless_dir, summary_file_path.replace("/", "__.")
+    return PendingDocument(
+        name=name,
+        file_content=file_content,
+        page_hash=page_hash,
+        summary_file_path=summary_file_path,
+    )
+
+
+async def process_files(
+    session: ParseSession, names_files: List[Tuple[str, str]]
+) -> List[str]:
+    # Returns the names of the documents that could not be summarized
+    pending = [
+        document
+        for document in (_prepare_document(session, nf) for nf in names_files)
+        if document is not None
+    ]
+
+    # Cached documents are finalized before the LLM call so they stay done
+    # even if it fails
+    cached: List[Tuple[PendingDocument, LLMResource]] = []
+    uncached: List[PendingDocument] = []
+    for document in pending:
+        agent_response = SummaryCacheEntry.get_cached(
+            summary_cache_key(document.name, document.page_hash), SUMMARIZER_VERSION
         )
-        logger.info(f"Useless file {useless_file}...")
-        with open(useless_file, "w") as f:
-            f.write("")
-        return
+        if agent_response is None:
+            uncached.append(document)
+        else:
+            logger.info(f"Using cached summary for {document.name}...")
+            cached.append((document, agent_response))
+    _finalize_documents(session, cached)
+    if not uncached:
+        return []
 
-    with open(summary_file_path, "w") as f:
-        f.write(agent_response.long_markdown_summary)
+    # Results are cached and finalized as they arrive, so a document that
+    # fails doesn't cost the others of its batch their LLM calls
+    by_name = {document.name: document for document in uncached}
 
-    r = Resource(
-        knowledge_base=knowledge_base,
-        identifier=name,
-        summary_file_path=summary_file_path,
-        short_description=agent_response.short_description,
+    def finalize(responses: Dict[str, LLMResource]) -> None:
+        summarized = [(by_name[name], response) for name, response in responses.items()]
+        SummaryCacheEntry.put_many(
+            SUMMARIZER_VERSION,
+            [
+                (summary_cache_key(document.name, document.page_hash), response)
+                for document, response in summarized
+            ],
+        )
+        _finalize_documents(session, summarized)
+
+    logger.info(f"Processing {', '.join(d.name for d in uncached)}...")
+    responses = await get_batch_summarizer_response(
+        [(d.name, d.file_content) for d in uncached], session.limiter, finalize
     )
-    r.upsert_resource()
+    return [document.name for document in uncached if document.name not in responses]
 
 
-async def process_all_files(knowledge_base: str, force: bool = False):
+async def process_file(session: ParseSession, name_file: Tuple[str, str]) -> List[str]:
+    return await process_files(session, [name_file])
+
+
+def estimate_file_tokens(page_file: str) -> int:
+    return os.path.getsize(page_file) // 4 + 1
+
+
+def plan_batches(
+    names_files: List[Tuple[str, str]],
+    small_document_tokens: int = PARSER_CONFIG.small_document_tokens,
+    max_batch_documents: int = PARSER_CONFIG.max_batch_documents,
+    max_batch_tokens: int = PARSER_CONFIG.max_batch_tokens,
+) -> List[List[Tuple[str, str]]]:
+    # Page sizes come from the file system so planning doesn't read every page
+    jobs: List[List[Tuple[str, str]]] = []
+    batch: List[Tuple[str, str]] = []
+    batch_tokens = 0
+    for name_file in names_files:
+        tokens = estimate_file_tokens(name_file[1])
+        if tokens > small_document_tokens:
+            jobs.append([name_file])
+            continue
+        if batch and (
+            len(batch) >= max_batch_documents
+            or batch_tokens + tokens > max_batch_tokens
+        ):
+            jobs.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(name_file)
+        batch_tokens += tokens
+    if batch:
+        jobs.append(batch)
+    return jobs
+
+
+async def process_with_retries(
+    session: ParseSession, names_files: List[Tuple[str, str]], max_retries: int
+) -> List[str]:
+    # Only documents that failed are retried, finished documents of a batch
+    # were already finalized. Returns the names given up on
+    remaining = names_files
+    for attempt in range(1, max_retries + 1):
+        names = ", ".join(name for name, _ in remaining)
+        try:
+            failed = await process_files(session, remaining)
+            if not failed:
+                return []
+            remaining = [name_file for name_file in remaining if name_file[0] in failed]
+            error = f"{len(failed)} documents failed"
+        except Exception as e:
+            error = str(e)
+        if attempt == max_retries:
+            logger.error(f"Giving up on {names} after {attempt} attempts: {error}")
+            return [name for name, _ in remaining]
+        delay = PARSER_CONFIG.retry_base_delay * 2 ** (attempt - 1)
+        delay *= 1 + random.random() / 2
+        logger.warning(f"Error processing {names} ({error}), retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
+    return [name for name, _ in remaining]
+
+
+async def _parser_worker(
+    session: ParseSession,
+    queue: "asyncio.Queue[List[Tuple[str, str]]]",
+    max_retries: int,
+    failed: List[str],
+) -> None:
+    while True:
+        names_files = await queue.get()
+        try:
+            failed.extend(await process_with_retries(session, names_files, max_retries))
+        finally:
+            queue.task_done()
+
+
+async def process_all_files(
+    knowledge_base: str,
+    force: bool = False,
+    max_concurrency: int = PARSER_CONFIG.max_concurrency,
+    limiter: Optional[LLMRateLimiter] = None,
+    max_retries: int = PARSER_CONFIG.max_retries,
+    dedup: bool = PARSER_CONFIG.dedup,
+    batch_small_documents: bool = PARSER_CONFIG.batch_small_documents,
+) -> List[str]:
     files = get_all_files_for_processing(knowledge_base)
-    files_per_batch = 20
-    n_batches = math.ceil(len(files) / files_per_batch)
-    batches = [files[i::n_batches] for i in range(n_batches)]
-    assert sum(len(batch) for batch in batches) == len(files)
-    for batch in batches:
-        await asyncio.gather(
-            *[process_file(knowledge_base, file, force) for file in batch]
+    session = new_parse_session(knowledge_base, force, limiter)
+
+    if dedup:
+        files, duplicates = deduplicate_files(knowledge_base, files)
+        ProcessedDocument.upsert_documents(duplicates)
+        session.documents.update({d.identifier: d for d in duplicates})
+        logger.info(
+            f"Summarizing {len(files)} representatives, skipping {len(duplicates)} near duplicates"
         )
 
+    jobs = plan_batches(files) if batch_small_documents else [[nf] for nf in files]
+    logger.info(f"Summarizing {len(files)} files in {len(jobs)} jobs")
+
+    # A fixed pool of workers pulling from one queue: a slow call only holds
+    # its own worker and a failing job never takes others down with it
+    queue: asyncio.Queue[List[Tuple[str, str]]] = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+
+    failed: List[str] = []
+    workers = [
+        asyncio.create_task(_parser_worker(session, queue, max_retries, failed))
+        for _ in range(max(1, max_concurrency))
+    ]
+    try:
+        await queue.join()
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    logger.info(
+        f"Processed {len(files) - len(failed)} of {len(files)} files for {knowledge_base}"
+    )
+    return failed
+
 
 def run_parser(knowledge_base: str, force: bool = False):
     asyncio.run(process_all_files(knowledge_base, force))
@@ -99,14 +418,5 @@ def run_parser(knowledge_base: str, force: bool = False):
 if __name__ == "__main__":
     db_init()
     setup_stdout_logging()
-    run_parser("zed_docs")
-    run_parser("agno_docs")
-    run_parser("ash_docs")
-    run_parser("ash_docs_authentication")
-    run_parser("ash_docs_json")
-    run_parser("ash_docs_postgres")
-    run_parser("ecto_docs")
-    run_parser("phoenix_docs")
-    run_parser("live_view_docs")
-    run_parser("fly_docs")
-    run_parser("fastapi_docs")
+    for spec in JobsConfig.load().enabled_knowledge_bases():
+        run_parser(spec.name, spec.force)
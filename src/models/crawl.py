@@ -0,0 +1,200 @@
+import json
+from datetime import datetime, timezone
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
+from src.utils.db_context import DBCursor
+
+
+def utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class CrawlManifestEntry(BaseModel):
+    knowledge_base: str
+    url: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    fetched_at: str = Field(default_factory=utc_now)
+    content_hash: Optional[str] = None
+    links: List[str] = []
+
+    @staticmethod
+    def db_init():
+        with DBCursor() as cursor:
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS crawl_manifest (
+                    knowledge_base TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    fetched_at TEXT NOT NULL,
+                    content_hash TEXT,
+                    links TEXT NOT NULL DEFAULT '[]',
+                    PRIMARY KEY (knowledge_base, url)
+                );
+                """
+            )
+
+    def fetched_at_datetime(self) -> datetime:
+        return datetime.fromisoformat(self.fetched_at)
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def matches_validators(
+        self, etag: Optional[str], last_modified: Optional[str]
+    ) -> bool:
+        # The strongest validator that was stored decides
+        if self.etag:
+            return etag == self.etag
+        return bool(self.last_modified) and last_modified == self.last_modified
+
+    @staticmethod
+    def get_manifest(knowledge_base: str) -> Dict[str, "CrawlManifestEntry"]:
+        with DBCursor() as cursor:
+            cursor.execute(
+                """
+                SELECT * FROM crawl_manifest WHERE knowledge_base = :knowledge_base;
+                """,
+                {"knowledge_base": knowledge_base},
+            )
+            return {
+                row["url"]: CrawlManifestEntry(
+                    **{**dict(row), "links": json.loads(row["links"])}
+                )
+                for row in cursor.fetchall()
+            }
+
+    def upsert_entry(self):
+        with DBCursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO crawl_manifest (knowledge_base, url, etag, last_modified, fetched_at, content_hash, links)
+                VALUES (:knowledge_base, :url, :etag, :last_modified, :fetched_at, :content_hash, :links)
+                ON CONFLICT(knowledge_base, url) DO UPDATE SET
+                    etag = excluded.etag,
+                    last_modified = excluded.last_modified,
+                    fetched_at = excluded.fetched_at,
+                    content_hash = excluded.content_hash,
+                    links = excluded.links;
+                """,
+                {**self.__dict__, "links": json.dumps(self.links)},
+            )
+
+
+FRONTIER_PENDING = "pending"
+FRONTIER_IN_FLIGHT = "in_flight"
+FRONTIER_DONE = "done"
+FRONTIER_FAILED = "failed"
+
+
+class FrontierRecord(BaseModel):
+    knowledge_base: str
+    key: str
+    url: str
+    depth: int
+    max_depth: int
+    lastmod: Optional[str] = None
+    state: str = FRONTIER_PENDING
+    retries: int = 0
+    last_error: Optional[str] = None
+    updated_at: str = Field(default_factory=utc_now)
+
+    @staticmethod
+    def db_init():
+        with DBCursor() as cursor:
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS crawl_frontier (
+                    knowledge_base TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    depth INTEGER NOT NULL,
+                    max_depth INTEGER NOT NULL,
+                    lastmod TEXT,
+                    state TEXT NOT NULL,
+                    retries INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (knowledge_base, key)
+                );
+                """
+            )
+
+    @staticmethod
+    def get_frontier(knowledge_base: str) -> List["FrontierRecord"]:
+        with DBCursor() as cursor:
+            cursor.execute(
+                """
+                SELECT * FROM crawl_frontier WHERE knowledge_base = :knowledge_base;
+                """,
+                {"knowledge_base": knowledge_base},
+            )
+            return [FrontierRecord(**row) for row in cursor.fetchall()]
+
+    @staticmethod
+    def insert_records(records: List["FrontierRecord"]):
+        if not records:
+            return
+        with DBCursor() as cursor:
+            cursor.executemany(
+                """
+                INSERT INTO crawl_frontier (knowledge_base, key, url, depth, max_depth, lastmod, state, retries, last_error, updated_at)
+                VALUES (:knowledge_base, :key, :url, :depth, :max_depth, :lastmod, :state, :retries, :last_error, :updated_at)
+                ON CONFLICT(knowledge_base, key) DO UPDATE SET
+                    url = excluded.url,
+                    depth = excluded.depth,
+                    max_depth = excluded.max_depth,
+                    lastmod = coalesce(excluded.lastmod, lastmod),
+                    state = excluded.state,
+                    retries = excluded.retries,
+                    last_error = excluded.last_error,
+                    updated_at = excluded.updated_at
+                WHERE excluded.max_depth - excluded.depth > max_depth - depth;
+                """,
+                [r.__dict__ for r in records],
+            )
+
+    @staticmethod
+    def set_state(
+        knowledge_base: str,
+        key: str,
+        state: str,
+        retries: Optional[int] = None,
+        last_error: Optional[str] = None,
+    ):
+        with DBCursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE crawl_frontier SET
+                    state = :state,
+                    retries = coalesce(:retries, retries),
+                    last_error = coalesce(:last_error, last_error),
+                    updated_at = :updated_at
+                WHERE knowledge_base = :knowledge_base AND key = :key;
+                """,
+                {
+                    "knowledge_base": knowledge_base,
+                    "key": key,
+                    "state": state,
+                    "retries": retries,
+                    "last_error": last_error,
+                    "updated_at": utc_now(),
+                },
+            )
+
+    @staticmethod
+    def clear_frontier(knowledge_base: str):
+        with DBCursor() as cursor:
+            cursor.execute(
+                """
+                DELETE FROM crawl_frontier WHERE knowledge_base = :knowledge_base;
+                """,
+                {"knowledge_base": knowledge_base},
+            )
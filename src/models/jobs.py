@@ -0,0 +1,44 @@
+import tomllib
+from pydantic import BaseModel, Field
+from typing import List
+
+from cfg import RUNNER_CONFIG
+
+
+class KnowledgeBaseSpec(BaseModel):
+    name: str
+    base_url: str
+    priority: int = 0
+    max_depth: int = 3
+    redo: bool = False
+    refresh: bool = False
+    force: bool = False
+    alternative_seeds: List[str] = Field(default_factory=list)
+    ignored_tags: List[str] = Field(default_factory=list)
+    enabled: bool = True
+
+    @property
+    def crawl_url(self) -> str:
+        return self.base_url if self.base_url.endswith("/") else self.base_url + "/"
+
+
+class RunnerSettings(BaseModel):
+    max_jobs: int = RUNNER_CONFIG.max_jobs
+    progress_interval: float = RUNNER_CONFIG.progress_interval
+
+
+class JobsConfig(BaseModel):
+    runner: RunnerSettings = Field(default_factory=RunnerSettings)
+    knowledge_bases: List[KnowledgeBaseSpec] = Field(default_factory=list)
+
+    @staticmethod
+    def load(path: str = RUNNER_CONFIG.config_file) -> "JobsConfig":
+        with open(path, "rb") as f:
+            return JobsConfig(**tomllib.load(f))
+
+    def enabled_knowledge_bases(self, only: List[str] = []) -> List[KnowledgeBaseSpec]:
+        return [
+            spec
+            for spec in self.knowledge_bases
+            if spec.enabled and (not only or spec.name in only)
+        ]
@@ -1,6 +1,7 @@
 from os import stat
 from pydantic import BaseModel, Field
-from typing import List
+import os
+from typing import Dict, List, Optional
 from src.utils.db_context import DBCursor
 
 
@@ -55,6 +56,32 @@ class KnowledgeBase(BaseModel):
             )
             return [KnowledgeBase(**row) for row in cursor.fetchall()]
 
+    @staticmethod
+    def get_knowledge_base_keys() -> Dict[str, str]:
+        # Name -> the lowercased key its resources and versions are stored by
+        with DBCursor() as cursor:
+            cursor.execute(
+                """
+                SELECT name, lower(name) AS key FROM knowledge_bases;
+                """
+            )
+            return {row["name"]: row["key"] for row in cursor.fetchall()}
+
+
+def fts_query(text: str) -> str:
+    # Every whitespace separated term becomes a quoted phrase, so identifiers
+    # like Ash.Changeset.for_create match as a token sequence and FTS5 syntax
+    # characters in user input are never interpreted
+    return " ".join('"' + term.replace('"', '""') + '"' for term in text.split())
+
+
+class TextSearchHit(BaseModel):
+    knowledge_base: str
+    identifier: str
+    summary_file_path: str
+    snippet: str
+    rank: float
+
 
 class Resource(BaseModel):
     knowledge_base: str
@@ -64,18 +91,165 @@ class Resource(BaseModel):
 
     @staticmethod
     def db_init():
+        create_table = """
+            CREATE TABLE IF NOT EXISTS resources (
+                id INTEGER PRIMARY KEY,
+                knowledge_base TEXT NOT NULL,
+                identifier TEXT NOT NULL,
+                summary_file_path TEXT NOT NULL,
+                short_description TEXT NOT NULL,
+                revision INTEGER NOT NULL DEFAULT 0,
+                knowledge_base_key TEXT GENERATED ALWAYS AS (lower(knowledge_base)) VIRTUAL,
+                UNIQUE (knowledge_base, identifier)
+            );
+        """
         with DBCursor() as cursor:
+            cursor.execute(create_table)
+            cursor.execute("PRAGMA table_xinfo(resources);")
+            columns = {row["name"] for row in cursor.fetchall()}
+            if "id" not in columns:
+                # Older tables linked their text rows through the implicit
+                # rowid, which VACUUM may renumber. The rebuilt table keeps
+                # the rowids as explicit ids so existing text rows stay linked
+                revision = "revision" if "revision" in columns else "0"
+                cursor.execute("ALTER TABLE resources RENAME TO resources_old;")
+                cursor.execute(create_table)
+                cursor.execute(
+                    f"""
+                    INSERT INTO resources (id, knowledge_base, identifier, summary_file_path, short_description, revision)
+                    SELECT rowid, knowledge_base, identifier, summary_file_path, short_description, {revision}
+                    FROM resources_old;
+                    """
+                )
+                cursor.execute("DROP TABLE resources_old;")
+            # Case-insensitive knowledge base lookups compare against the
+            # lowercased key, which this index serves for equality, prefixes
+            # and the revisions of one knowledge base
+            cursor.execute("DROP INDEX IF EXISTS resources_knowledge_base_key;")
+            cursor.execute("DROP INDEX IF EXISTS resources_revision;")
             cursor.execute(
-                f"""
-                CREATE TABLE IF NOT EXISTS resources (
-                    knowledge_base TEXT NOT NULL,
-                    identifier TEXT NOT NULL,
-                    summary_file_path TEXT NOT NULL,
-                    short_description TEXT NOT NULL,
-                    PRIMARY KEY (knowledge_base, identifier)
+                """
+                CREATE INDEX IF NOT EXISTS resources_key_revision
+                ON resources (knowledge_base_key, revision);
+                """
+            )
+            # Text rows use the resource id as their rowid, an upsert keeps the
+            # id of the resource so its text row is replaced in place
+            cursor.execute(
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS resources_fts USING fts5 (
+                    knowledge_base UNINDEXED,
+                    identifier,
+                    short_description,
+                    summary,
+                    page,
+                    tokenize = 'porter unicode61'
                 );
                 """
             )
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS resource_versions (
+                    knowledge_base TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL DEFAULT 0
+                );
+                """
+            )
+            # Versions are kept per lowercased knowledge base key, versions of
+            # differently cased names from before are folded into their key
+            cursor.execute(
+                """
+                INSERT INTO resource_versions (knowledge_base, version)
+                SELECT lower(knowledge_base), SUM(version) FROM resource_versions
+                WHERE knowledge_base != lower(knowledge_base)
+                GROUP BY lower(knowledge_base)
+                ON CONFLICT(knowledge_base) DO UPDATE SET
+                    version = version + excluded.version;
+                """
+            )
+            cursor.execute(
+                """
+                DELETE FROM resource_versions WHERE knowledge_base != lower(knowledge_base);
+                """
+            )
+            # Resources written before versions existed get version 0, the
+            # catalog starts below that so its first refresh loads them all
+            cursor.execute(
+                """
+                INSERT OR IGNORE INTO resource_versions (knowledge_base, version)
+                SELECT DISTINCT knowledge_base_key, 0 FROM resources;
+                """
+            )
+
+    @staticmethod
+    def _bump_version(cursor, knowledge_bases: List[str]):
+        # Lets in-process search indexes notice that a knowledge base changed.
+        # Runs before the resource rows are written so they can take the new
+        # version as their revision
+        cursor.executemany(
+            """
+            INSERT INTO resource_versions (knowledge_base, version)
+            VALUES (lower(:knowledge_base), 1)
+            ON CONFLICT(knowledge_base) DO UPDATE SET version = version + 1;
+            """,
+            [{"knowledge_base": kb} for kb in sorted(set(knowledge_bases))],
+        )
+
+    @staticmethod
+    def _sync_text_index(cursor, rows: List[Dict]):
+        # A missing page keeps whatever page text was indexed before
+        cursor.executemany(
+            """
+            INSERT OR REPLACE INTO resources_fts (
+                rowid, knowledge_base, identifier, short_description, summary, page
+            )
+            SELECT
+                r.id, r.knowledge_base, r.identifier, r.short_description, :summary,
+                COALESCE(:page, (SELECT page FROM resources_fts WHERE rowid = r.id), '')
+            FROM resources r
+            WHERE r.knowledge_base = :knowledge_base AND r.identifier = :identifier;
+            """,
+            rows,
+        )
+
+    def _text_row(self, summary: Optional[str], page_markdown: Optional[str]) -> Dict:
+        if summary is None and os.path.exists(self.summary_file_path):
+            with open(self.summary_file_path, "r") as f:
+                summary = f.read()
+        return {
+            "knowledge_base": self.knowledge_base,
+            "identifier": self.identifier,
+            "summary": summary or "",
+            "page": page_markdown,
+        }
+
+    @staticmethod
+    def get_versions() -> Dict[str, int]:
+        # Knowledge base key -> version
+        with DBCursor() as cursor:
+            cursor.execute(
+                """
+                SELECT knowledge_base, version FROM resource_versions;
+                """
+            )
+            return {row["knowledge_base"]: row["version"] for row in cursor.fetchall()}
+
+    @staticmethod
+    def get_resources_changed_since(
+        knowledge_base: str, revision: int
+    ) -> List["Resource"]:
+        # A resource's revision is the knowledge base version of its last
+        # upsert, so this returns everything written after that version
+        with DBCursor() as cursor:
+            cursor.execute(
+                """
+                SELECT * FROM resources
+                WHERE knowledge_base_key = lower(:knowledge_base) AND revision > :revision
+                ORDER BY id;
+                """,
+                {"knowledge_base": knowledge_base, "revision": revision},
+            )
+            return [Resource(**row) for row in cursor.fetchall()]
 
     def context_string(self):
         return f"Resource(resource_file_path={self.summary_file_path}, summary={self.short_description})"
@@ -85,9 +259,9 @@ class Resource(BaseModel):
         with DBCursor() as cursor:
             cursor.execute(
                 """
-                SELECT * FROM resources WHERE lower(knowledge_base) LIKE lower(:pattern);
+                SELECT * FROM resources WHERE knowledge_base_key = lower(:knowledge_base);
                 """,
-                {"pattern": knowledge_base},
+                {"knowledge_base": knowledge_base},
             )
             return [Resource(**row) for row in cursor.fetchall()]
 
@@ -98,38 +272,97 @@ class Resource(BaseModel):
         with DBCursor() as cursor:
             cursor.execute(
                 """
-                SELECT * FROM resources WHERE lower(knowledge_base) LIKE lower(:pattern);
+                SELECT * FROM resources
+                WHERE knowledge_base_key >= lower(:prefix)
+                    AND knowledge_base_key < lower(:prefix) || char(1114111);
                 """,
-                {"pattern": f"{knowledge_base}%"},
+                {"prefix": knowledge_base},
             )
             return [Resource(**row) for row in cursor.fetchall()]
 
-    def upsert_resource(self):
+    def upsert_resource(
+        self, summary: Optional[str] = None, page_markdown: Optional[str] = None
+    ):
         with DBCursor() as cursor:
+            Resource._bump_version(cursor, [self.knowledge_base])
             cursor.execute(
                 """
-                INSERT INTO resources (knowledge_base, identifier, summary_file_path, short_description)
-                VALUES (:knowledge_base, :identifier, :summary_file_path, :short_description)
+                INSERT INTO resources (knowledge_base, identifier, summary_file_path, short_description, revision)
+                VALUES (
+                    :knowledge_base, :identifier, :summary_file_path, :short_description,
+                    (SELECT version FROM resource_versions WHERE knowledge_base = lower(:knowledge_base))
+                )
                 ON CONFLICT(knowledge_base, identifier) DO UPDATE SET
                     summary_file_path = excluded.summary_file_path,
-                    short_description = excluded.short_description;
+                    short_description = excluded.short_description,
+                    revision = excluded.revision;
                 """,
                 self.__dict__,
             )
+            Resource._sync_text_index(cursor, [self._text_row(summary, page_markdown)])
 
     @staticmethod
-    def upsert_resources(rs: List["Resource"]):
+    def upsert_resources(
+        rs: List["Resource"],
+        page_markdowns: Dict[str, str] = {},
+        summaries: Dict[str, str] = {},
+    ):
         with DBCursor() as cursor:
+            Resource._bump_version(cursor, [r.knowledge_base for r in rs])
             cursor.executemany(
                 """
-                INSERT INTO resources (knowledge_base, identifier, summary_file_path, short_description)
-                VALUES (:knowledge_base, :identifier, :summary_file_path, :short_description)
+                INSERT INTO resources (knowledge_base, identifier, summary_file_path, short_description, revision)
+                VALUES (
+                    :knowledge_base, :identifier, :summary_file_path, :short_description,
+                    (SELECT version FROM resource_versions WHERE knowledge_base = lower(:knowledge_base))
+                )
                 ON CONFLICT(knowledge_base, identifier) DO UPDATE SET
                     summary_file_path = excluded.summary_file_path,
-                    short_description = excluded.short_description;
+                    short_description = excluded.short_description,
+                    revision = excluded.revision;
                 """,
                 [r.__dict__ for r in rs],
             )
+            Resource._sync_text_index(
+                cursor,
+                [
+                    r._text_row(
+                        summaries.get(r.identifier), page_markdowns.get(r.identifier)
+                    )
+                    for r in rs
+                ],
+            )
+
+    @staticmethod
+    def search_text(
+        knowledge_base: str, query: str, limit: int = 10
+    ) -> List["TextSearchHit"]:
+        match = fts_query(query)
+        if not match:
+            return []
+        with DBCursor() as cursor:
+            cursor.execute(
+                """
+                SELECT
+                    r.knowledge_base,
+                    r.identifier,
+                    r.summary_file_path,
+                    snippet(resources_fts, -1, '**', '**', '...', 24) AS snippet,
+                    bm25(resources_fts, 0.0, 4.0, 2.0, 1.0, 1.0) AS rank
+                FROM resources_fts
+                JOIN resources r ON r.id = resources_fts.rowid
+                WHERE resources_fts MATCH :query
+                    AND r.knowledge_base_key = lower(:knowledge_base)
+                ORDER BY rank
+                LIMIT :limit;
+                """,
+                {
+                    "query": match,
+                    "knowledge_base": knowledge_base,
+                    "limit": limit,
+                },
+            )
+            return [TextSearchHit(**row) for row in cursor.fetchall()]
 
 
 class LLMResource(BaseModel):
@@ -157,6 +390,33 @@ class LLMResource(BaseModel):
     )
 
 
+class LLMResourceMerge(BaseModel):
+    short_description: str = Field(
+        ...,
+        description="""A short description of the whole resource, combining what its parts cover.
+        Keep it brief.
+        """,
+    )
+    useful: bool = Field(
+        ...,
+        description="""A boolean indicating whether the resource as a whole is useful, using the same strict criteria as for single documents.""",
+    )
+
+
+class IdentifiedLLMResource(LLMResource):
+    identifier: str = Field(
+        ...,
+        description="The identifier of the document this resource was produced from, exactly as given in the instructions.",
+    )
+
+
+class LLMResourceBatch(BaseModel):
+    resources: List[IdentifiedLLMResource] = Field(
+        ...,
+        description="One resource per document in the batch, each carrying the identifier of its document.",
+    )
+
+
 class DiscoveryOutput(BaseModel):
     resource_file_paths: List[str] = Field(
         ...,
@@ -0,0 +1,155 @@
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional, Tuple
+from src.models.crawl import utc_now
+from src.models.knowledge import LLMResource
+from src.utils.db_context import DBCursor
+
+DOCUMENT_SUMMARIZED = "summarized"
+DOCUMENT_USELESS = "useless"
+DOCUMENT_DUPLICATE = "duplicate"
+
+
+class ProcessedDocument(BaseModel):
+    knowledge_base: str
+    identifier: str
+    content_hash: str
+    status: str
+    prompt_version: str = ""
+    updated_at: str = Field(default_factory=utc_now)
+
+    @staticmethod
+    def db_init():
+        with DBCursor() as cursor:
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS processed_documents (
+                    knowledge_base TEXT NOT NULL,
+                    identifier TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    prompt_version TEXT NOT NULL DEFAULT '',
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (knowledge_base, identifier)
+                );
+                """
+            )
+            cursor.execute("PRAGMA table_info(processed_documents);")
+            if "prompt_version" not in {row["name"] for row in cursor.fetchall()}:
+                # Documents recorded before versions were stored count as
+                # summarized by an older prompt
+                cursor.execute(
+                    "ALTER TABLE processed_documents ADD COLUMN prompt_version TEXT NOT NULL DEFAULT '';"
+                )
+            cursor.execute(
+                """
+                CREATE INDEX IF NOT EXISTS processed_documents_hash_idx
+                ON processed_documents (knowledge_base, content_hash);
+                """
+            )
+
+    @staticmethod
+    def get_documents(knowledge_base: str) -> Dict[str, "ProcessedDocument"]:
+        with DBCursor() as cursor:
+            cursor.execute(
+                """
+                SELECT * FROM processed_documents WHERE knowledge_base = :knowledge_base;
+                """,
+                {"knowledge_base": knowledge_base},
+            )
+            return {
+                row["identifier"]: ProcessedDocument(**row)
+                for row in cursor.fetchall()
+            }
+
+    def upsert_document(self):
+        ProcessedDocument.upsert_documents([self])
+
+    @staticmethod
+    def upsert_documents(ds: List["ProcessedDocument"]):
+        with DBCursor() as cursor:
+            cursor.executemany(
+                """
+                INSERT INTO processed_documents (knowledge_base, identifier, content_hash, status, prompt_version, updated_at)
+                VALUES (:knowledge_base, :identifier, :content_hash, :status, :prompt_version, :updated_at)
+                ON CONFLICT(knowledge_base, identifier) DO UPDATE SET
+                    content_hash = excluded.content_hash,
+                    status = excluded.status,
+                    prompt_version = excluded.prompt_version,
+                    updated_at = excluded.updated_at;
+                """,
+                [d.__dict__ for d in ds],
+            )
+
+
+class SummaryCacheEntry(BaseModel):
+    content_hash: str
+    prompt_version: str
+    short_description: str
+    long_markdown_summary: str
+    useful: bool
+    created_at: str = Field(default_factory=utc_now)
+
+    @staticmethod
+    def db_init():
+        with DBCursor() as cursor:
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS summary_cache (
+                    content_hash TEXT NOT NULL,
+                    prompt_version TEXT NOT NULL,
+                    short_description TEXT NOT NULL,
+                    long_markdown_summary TEXT NOT NULL,
+                    useful INTEGER NOT NULL,
+                    created_at TEXT NOT NULL,
+                    PRIMARY KEY (content_hash, prompt_version)
+                );
+                """
+            )
+
+    def to_llm_resource(self) -> LLMResource:
+        return LLMResource(
+            short_description=self.short_description,
+            long_markdown_summary=self.long_markdown_summary,
+            useful=self.useful,
+        )
+
+    @staticmethod
+    def get_cached(content_hash: str, prompt_version: str) -> Optional[LLMResource]:
+        with DBCursor() as cursor:
+            cursor.execute(
+                """
+                SELECT * FROM summary_cache
+                WHERE content_hash = :content_hash AND prompt_version = :prompt_version;
+                """,
+                {"content_hash": content_hash, "prompt_version": prompt_version},
+            )
+            row = cursor.fetchone()
+            return SummaryCacheEntry(**row).to_llm_resource() if row else None
+
+    @staticmethod
+    def put(content_hash: str, prompt_version: str, resource: LLMResource):
+        SummaryCacheEntry.put_many(prompt_version, [(content_hash, resource)])
+
+    @staticmethod
+    def put_many(prompt_version: str, resources: List[Tuple[str, LLMResource]]):
+        entries = [
+            SummaryCacheEntry(
+                content_hash=content_hash,
+                prompt_version=prompt_version,
+                **resource.model_dump(),
+            )
+            for content_hash, resource in resources
+        ]
+        with DBCursor() as cursor:
+            cursor.executemany(
+                """
+                INSERT INTO summary_cache (content_hash, prompt_version, short_description, long_markdown_summary, useful, created_at)
+                VALUES (:content_hash, :prompt_version, :short_description, :long_markdown_summary, :useful, :created_at)
+                ON CONFLICT(content_hash, prompt_version) DO UPDATE SET
+                    short_description = excluded.short_description,
+                    long_markdown_summary = excluded.long_markdown_summary,
+                    useful = excluded.useful,
+                    created_at = excluded.created_at;
+                """,
+                [entry.__dict__ for entry in entries],
+            )
@@ -0,0 +1,217 @@
+import argparse
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import List, Optional, Set, Tuple
+
+from cfg import CRAWL_CONFIG, PARSER_CONFIG, PIPELINE_CONFIG
+from scripts.db_init import db_init
+from src.crawler.politeness import HostScheduler
+from src.llm_parser import (
+    ParseSession,
+    check_duplicate,
+    estimate_file_tokens,
+    new_parse_session,
+    page_identifier,
+    plan_batches,
+    process_with_retries,
+)
+from src.models.knowledge import KnowledgeBase
+from src.utils.dedup import NearDuplicateIndex
+from src.utils.rate_limit import LLMRateLimiter
+from src.web_crawler import scrape_website
+from utils.loggers import setup_stdout_logging
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PipelineStats:
+    pages: int = 0
+    duplicates: int = 0
+    processed: int = 0
+    failed: List[str] = field(default_factory=list)
+
+
+@dataclass
+class PipelineRun:
+    session: ParseSession
+    pages: "asyncio.Queue[str]"
+    documents: "asyncio.Queue[Tuple[str, str]]"
+    index: Optional[NearDuplicateIndex]
+    batch_small_documents: bool
+    max_retries: int
+    stats: PipelineStats
+    seen: Set[str] = field(default_factory=set)
+
+
+async def _dedup_stage(run: PipelineRun) -> None:
+    # The first copy of a page to arrive represents its cluster, unlike the
+    # batch parser which can pick the shortest identifier up front
+    knowledge_base = run.session.knowledge_base
+    while True:
+        page_file = await run.pages.get()
+        try:
+            name = page_identifier(knowledge_base, page_file)
+            if name in run.seen:
+                continue
+            run.seen.add(name)
+            run.stats.pages += 1
+            if run.index is not None:
+                duplicate = check_duplicate(run.index, knowledge_base, name, page_file)
+                if duplicate is not None:
+                    duplicate.upsert_document()
+                    run.session.documents[name] = duplicate
+                    run.stats.duplicates += 1
+                    continue
+            await run.documents.put((name, page_file))
+        except Exception as e:
+            logger.error(f"Error deduplicating {page_file}: {e}")
+        finally:
+            run.pages.task_done()
+
+
+async def _take_documents(run: PipelineRun) -> List[Tuple[str, str]]:
+    # Small pages already waiting in the queue are summarized together, a
+    # large page taken on the way ends the batch
+    taken = [await run.documents.get()]
+    if (
+        run.batch_small_documents
+        and estimate_file_tokens(taken[0][1]) <= PARSER_CONFIG.small_document_tokens
+    ):
+        while (
+            len(taken) < PARSER_CONFIG.max_batch_documents and not run.documents.empty()
+        ):
+            taken.append(run.documents.get_nowait())
+            if estimate_file_tokens(taken[-1][1]) > PARSER_CONFIG.small_document_tokens:
+                break
+    return taken
+
+
+async def _summarize_worker(run: PipelineRun) -> None:
+    while True:
+        taken = await _take_documents(run)
+        try:
+            jobs = (
+                plan_batches(taken)
+                if run.batch_small_documents
+                else [[nf] for nf in taken]
+            )
+            for job in jobs:
+                failed = await process_with_retries(run.session, job, run.max_retries)
+                run.stats.processed += len(job) - len(failed)
+                run.stats.failed.extend(failed)
+        finally:
+            for _ in taken:
+                run.documents.task_done()
+
+
+async def crawl_and_summarize(
+    base_url: str,
+    knowledge_base: str,
+    max_depth: int = 3,
+    redo: bool = False,
+    refresh: bool = False,
+    force: bool = False,
+    ignored_tags: List[str] = [],
+    alternative_seeds: List[str] = [],
+    max_concurrency: int = CRAWL_CONFIG.max_concurrency,
+    summarize_workers: int = PIPELINE_CONFIG.summarize_workers,
+    queue_size: int = PIPELINE_CONFIG.queue_size,
+    dedup: bool = PARSER_CONFIG.dedup,
+    batch_small_documents: bool = PARSER_CONFIG.batch_small_documents,
+    max_retries: int = PARSER_CONFIG.max_retries,
+    scheduler: Optional[HostScheduler] = None,
+    limiter: Optional[LLMRateLimiter] = None,
+    stats: Optional[PipelineStats] = None,
+) -> List[str]:
+    # frontier -> render -> persist happen inside the crawl workers, pages then
+    # flow through bounded queues into dedup -> summarize -> upsert so a full
+    # queue pauses the crawl instead of piling pages up in memory
+    run = PipelineRun(
+        session=new_parse_session(knowledge_base, force, limiter),
+        pages=asyncio.Queue(maxsize=queue_size),
+        documents=asyncio.Queue(maxsize=queue_size),
+        index=(
+            NearDuplicateIndex(max_distance=PARSER_CONFIG.dedup_max_distance)
+            if dedup
+            else None
+        ),
+        batch_small_documents=batch_small_documents,
+        max_retries=max_retries,
+        stats=stats or PipelineStats(),
+    )
+
+    stages = [asyncio.create_task(_dedup_stage(run))] + [
+        asyncio.create_task(_summarize_worker(run))
+        for _ in range(max(1, summarize_workers))
+    ]
+    try:
+        await scrape_website(
+            base_url=base_url,
+            knowledge_base=knowledge_base,
+            max_depth=max_depth,
+            redo=redo,
+            ignored_tags=ignored_tags,
+            alternative_seeds=alternative_seeds,
+            max_concurrency=max_concurrency,
+            refresh=refresh,
+            scheduler=scheduler,
+            page_sink=run.pages.put,
+        )
+        await run.pages.join()
+        await run.documents.join()
+    finally:
+        for stage in stages:
+            stage.cancel()
+        await asyncio.gather(*stages, return_exceptions=True)
+
+    logger.info(
+        f"Pipeline for {knowledge_base} finished: {run.stats.pages} pages, "
+        f"{run.stats.duplicates} near duplicates, {len(run.stats.failed)} failed"
+    )
+    return run.stats.failed
+
+
+def run_pipeline(
+    base_url: str,
+    knowledge_base: str,
+    max_depth: int = 3,
+    redo: bool = False,
+    refresh: bool = False,
+    force: bool = False,
+    alternative_seeds: List[str] = [],
+):
+    use_base = base_url if base_url.endswith("/") else base_url + "/"
+    KnowledgeBase.create_knowledge_base(knowledge_base, base_url)
+    return asyncio.run(
+        crawl_and_summarize(
+            base_url=use_base,
+            knowledge_base=knowledge_base,
+            max_depth=max_depth,
+            redo=redo,
+            refresh=refresh,
+            force=force,
+            alternative_seeds=alternative_seeds,
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base_url")
+    parser.add_argument("knowledge_base")
+    parser.add_argument("--max-depth", type=int, default=3)
+    parser.add_argument("--refresh", action="store_true")
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+
+    db_init()
+    setup_stdout_logging()
+    run_pipeline(
+        args.base_url,
+        args.knowledge_base,
+        max_depth=args.max_depth,
+        refresh=args.refresh,
+        force=args.force,
+    )
@@ -0,0 +1,190 @@
+import argparse
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from cfg import PARSER_CONFIG, RUNNER_CONFIG
+from scripts.db_init import db_init
+from src.crawler.politeness import HostScheduler
+from src.llm_parser import process_all_files
+from src.models.jobs import JobsConfig, KnowledgeBaseSpec
+from src.models.knowledge import KnowledgeBase
+from src.pipeline import PipelineStats, crawl_and_summarize
+from src.utils.rate_limit import LLMRateLimiter
+from src.web_crawler import scrape_website
+from utils.loggers import setup_stdout_logging
+
+logger = logging.getLogger(__name__)
+
+JOB_MODES = ("pipeline", "crawl", "parse")
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+@dataclass
+class JobState:
+    spec: KnowledgeBaseSpec
+    mode: str
+    state: str = JOB_QUEUED
+    stats: PipelineStats = field(default_factory=PipelineStats)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def describe(self) -> str:
+        line = (
+            f"{self.spec.name} [{self.mode}] {self.state} {self.elapsed():.0f}s: "
+            f"{self.stats.pages} pages, {self.stats.duplicates} duplicates, "
+            f"{self.stats.processed} processed, {len(self.stats.failed)} failed"
+        )
+        return f"{line} ({self.error})" if self.error else line
+
+
+@dataclass
+class JobRunner:
+    # Shared by every job so per-host politeness and the LLM budget hold
+    # across knowledge bases, e.g. the hexdocs.pm sites share one host limit
+    scheduler: HostScheduler
+    limiter: LLMRateLimiter
+    jobs: Dict[str, JobState]
+
+
+async def _count_page(stats: PipelineStats, page_file: str) -> None:
+    stats.pages += 1
+
+
+async def _run_job(runner: JobRunner, job: JobState) -> None:
+    spec = job.spec
+    if job.mode != "parse":
+        KnowledgeBase.create_knowledge_base(spec.name, spec.base_url)
+
+    if job.mode == "pipeline":
+        await crawl_and_summarize(
+            base_url=spec.crawl_url,
+            knowledge_base=spec.name,
+            max_depth=spec.max_depth,
+            redo=spec.redo,
+            refresh=spec.refresh,
+            force=spec.force,
+            ignored_tags=spec.ignored_tags,
+            alternative_seeds=spec.alternative_seeds,
+            scheduler=runner.scheduler,
+            limiter=runner.limiter,
+            stats=job.stats,
+        )
+    elif job.mode == "crawl":
+        await scrape_website(
+            base_url=spec.crawl_url,
+            knowledge_base=spec.name,
+            max_depth=spec.max_depth,
+            redo=spec.redo,
+            ignored_tags=spec.ignored_tags,
+            alternative_seeds=spec.alternative_seeds,
+            refresh=spec.refresh,
+            scheduler=runner.scheduler,
+            page_sink=lambda page_file: _count_page(job.stats, page_file),
+        )
+    else:
+        job.stats.failed = await process_all_files(
+            spec.name, force=spec.force, limiter=runner.limiter
+        )
+
+
+async def _job_worker(
+    runner: JobRunner, queue: "asyncio.PriorityQueue[Tuple[int, int, str]]"
+) -> None:
+    while True:
+        _, _, name = await queue.get()
+        job = runner.jobs[name]
+        job.state = JOB_RUNNING
+        job.started_at = time.monotonic()
+        logger.info(f"Starting {job.mode} job for {name}")
+        try:
+            await _run_job(runner, job)
+            job.state = JOB_DONE
+        except Exception as e:
+            # One broken site must not hold up the rest of the refresh
+            logger.error(f"Job for {name} failed: {e}")
+            job.state = JOB_FAILED
+            job.error = str(e)
+        finally:
+            job.finished_at = time.monotonic()
+            logger.info(job.describe())
+            queue.task_done()
+
+
+async def _report_progress(runner: JobRunner, interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        queued = sum(job.state == JOB_QUEUED for job in runner.jobs.values())
+        running = [job for job in runner.jobs.values() if job.state == JOB_RUNNING]
+        logger.info(f"Progress: {len(running)} running, {queued} queued")
+        for job in running:
+            logger.info(f"  {job.describe()}")
+
+
+async def run_jobs(
+    config: JobsConfig,
+    mode: str = "pipeline",
+    only: List[str] = [],
+) -> List[JobState]:
+    if mode not in JOB_MODES:
+        raise ValueError(f"Unknown mode {mode}, expected one of {JOB_MODES}")
+
+    specs = config.enabled_knowledge_bases(only)
+    runner = JobRunner(
+        scheduler=HostScheduler(),
+        limiter=LLMRateLimiter(
+            PARSER_CONFIG.requests_per_minute, PARSER_CONFIG.tokens_per_minute
+        ),
+        jobs={spec.name: JobState(spec=spec, mode=mode) for spec in specs},
+    )
+
+    # Highest priority first, config file order among equal priorities
+    queue: asyncio.PriorityQueue[Tuple[int, int, str]] = asyncio.PriorityQueue()
+    for i, spec in enumerate(specs):
+        queue.put_nowait((-spec.priority, i, spec.name))
+
+    workers = [
+        asyncio.create_task(_job_worker(runner, queue))
+        for _ in range(max(1, min(config.runner.max_jobs, len(specs))))
+    ]
+    reporter = asyncio.create_task(
+        _report_progress(runner, config.runner.progress_interval)
+    )
+    started = time.monotonic()
+    try:
+        await queue.join()
+    finally:
+        for task in [*workers, reporter]:
+            task.cancel()
+        await asyncio.gather(*workers, reporter, return_exceptions=True)
+
+    logger.info(
+        f"Finished {len(specs)} {mode} jobs in {time.monotonic() - started:.0f}s"
+    )
+    for job in runner.jobs.values():
+        logger.info(f"  {job.describe()}")
+    return list(runner.jobs.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default=RUNNER_CONFIG.config_file)
+    parser.add_argument("--mode", choices=JOB_MODES, default="pipeline")
+    parser.add_argument("--only", nargs="*", default=[])
+    args = parser.parse_args()
+
+    db_init()
+    setup_stdout_logging()
+    asyncio.run(run_jobs(JobsConfig.load(args.config), args.mode, args.only))
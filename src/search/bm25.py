@@ -0,0 +1,150 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from cfg import SEARCH_CONFIG
+from src.search.catalog import RESOURCE_CATALOG, CatalogEntry
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    def __init__(
+        self,
+        documents: Sequence[Counter],
+        k1: float = SEARCH_CONFIG.bm25_k1,
+        b: float = SEARCH_CONFIG.bm25_b,
+    ):
+        self.k1 = k1
+        self.b = b
+        self.size = len(documents)
+        # Documents are given as term counts
+        lengths = np.array(
+            [sum(counts.values()) for counts in documents], dtype=np.float64
+        )
+        avg_length = lengths.mean() if self.size and lengths.mean() > 0 else 1.0
+        self.length_norm = k1 * (1 - b + b * lengths / avg_length)
+
+        doc_ids: Dict[str, List[int]] = defaultdict(list)
+        term_freqs: Dict[str, List[int]] = defaultdict(list)
+        for doc_id, counts in enumerate(documents):
+            for term, tf in counts.items():
+                doc_ids[term].append(doc_id)
+                term_freqs[term].append(tf)
+
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {
+            term: (
+                np.array(doc_ids[term], dtype=np.int32),
+                np.array(term_freqs[term], dtype=np.float64),
+            )
+            for term in doc_ids
+        }
+        self.idf = {
+            term: float(np.log1p((self.size - len(ids) + 0.5) / (len(ids) + 0.5)))
+            for term, ids in doc_ids.items()
+        }
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        scores = np.zeros(self.size, dtype=np.float64)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            ids, tf = self.postings[term]
+            scores[ids] += (
+                self.idf[term] * tf * (self.k1 + 1) / (tf + self.length_norm[ids])
+            )
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        ranked = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(int(i), float(scores[i])) for i in ranked]
+
+
+def _resource_terms(resource: CatalogEntry) -> Counter:
+    # Identifier and description are short but the most telling fields, so
+    # they are counted twice next to the summary body
+    summary = ""
+    if os.path.exists(resource.summary_file_path):
+        with open(resource.summary_file_path, "r") as f:
+            summary = f.read()
+    return Counter(
+        tokenize(resource.identifier) * 2
+        + tokenize(resource.short_description) * 2
+        + tokenize(summary)
+    )
+
+
+class ResourceIndexCache:
+    # One index per knowledge base, rebuilt when the catalog version moved.
+    # While a parse keeps upserting, rebuilds are at least rebuild_interval
+    # apart and the previous index is served in between. The term counts of
+    # resources that didn't change are reused, so a rebuild only reads the
+    # summaries of changed resources from disk
+    def __init__(self, rebuild_interval: float = SEARCH_CONFIG.bm25_rebuild_interval):
+        self.rebuild_interval = rebuild_interval
+        self.lock = threading.Lock()
+        self.indexes: Dict[str, Tuple[int, float, BM25Index, List[CatalogEntry]]] = {}
+        self.terms: Dict[str, Dict[str, Tuple[CatalogEntry, Counter]]] = {}
+
+    def get(self, knowledge_base: str) -> Tuple[BM25Index, List[CatalogEntry]]:
+        catalog = RESOURCE_CATALOG.get(knowledge_base)
+        with self.lock:
+            cached = self.indexes.get(catalog.name)
+            if cached is not None and (
+                cached[0] == catalog.version
+                or time.monotonic() < cached[1] + self.rebuild_interval
+            ):
+                return cached[2], cached[3]
+
+            # Catalog entries are replaced when a resource changes, so an
+            # identical entry means the stored term counts are still valid
+            previous = self.terms.get(catalog.name, {})
+            terms: Dict[str, Tuple[CatalogEntry, Counter]] = {}
+            for r in catalog.resources:
+                known = previous.get(r.identifier)
+                if known is not None and known[0] is r:
+                    terms[r.identifier] = known
+                else:
+                    terms[r.identifier] = (r, _resource_terms(r))
+            resources = catalog.resources
+            index = BM25Index([terms[r.identifier][1] for r in resources])
+            self.terms[catalog.name] = terms
+            self.indexes[catalog.name] = (
+                catalog.version,
+                time.monotonic(),
+                index,
+                resources,
+            )
+            logger.info(
+                f"Built BM25 index for {knowledge_base} over {len(resources)} resources"
+            )
+            return index, resources
+
+
+RESOURCE_INDEXES = ResourceIndexCache()
+
+
+def search_resources(
+    knowledge_base: str, query: str, k: int = SEARCH_CONFIG.bm25_top_k
+) -> List[CatalogEntry]:
+    index, resources = RESOURCE_INDEXES.get(knowledge_base)
+    if len(resources) <= k:
+        return resources
+    hits = index.search(query, k)
+    if not hits:
+        logger.info(f"No BM25 matches in {knowledge_base} for {query!r}")
+        return resources[:k]
+    return [resources[i] for i, _ in hits]
@@ -0,0 +1,104 @@
+import logging
+import threading
+import time
+from typing import Dict, List
+
+from cfg import SEARCH_CONFIG
+from src.models.knowledge import KnowledgeBase, Resource
+from src.utils.rate_limit import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogEntry:
+    # One resource as the search paths need it, with its line of the
+    # discoverer prompt rendered once when the resource is loaded
+    __slots__ = (
+        "identifier",
+        "summary_file_path",
+        "short_description",
+        "context",
+        "context_tokens",
+    )
+
+    def __init__(self, resource: Resource):
+        self.identifier = resource.identifier
+        self.summary_file_path = resource.summary_file_path
+        self.short_description = resource.short_description
+        self.context = resource.context_string()
+        self.context_tokens = estimate_tokens(self.context)
+
+
+class KnowledgeBaseCatalog:
+    # Snapshots are never modified - a refresh builds a new one from the
+    # previous snapshot plus the changed rows and swaps it in, so readers in
+    # other threads always see a consistent version, entries and prompt block
+    __slots__ = (
+        "name",
+        "version",
+        "entries",
+        "resources",
+        "prompt_block",
+        "prompt_tokens",
+    )
+
+    def __init__(self, name: str, version: int, entries: Dict[str, CatalogEntry]):
+        self.name = name
+        self.version = version
+        self.entries = entries
+        self.resources: List[CatalogEntry] = list(entries.values())
+        self.prompt_block = "\n".join(entry.context for entry in self.resources)
+        self.prompt_tokens = sum(entry.context_tokens for entry in self.resources)
+
+    def updated(self, changed: List[Resource], version: int) -> "KnowledgeBaseCatalog":
+        # Changed resources keep their position, new ones are appended
+        entries = dict(self.entries)
+        for resource in changed:
+            entries[resource.identifier] = CatalogEntry(resource)
+        return KnowledgeBaseCatalog(self.name, version, entries)
+
+
+class ResourceCatalog:
+    # All resources of all knowledge bases, loaded once and then refreshed
+    # incrementally: the versions table is checked at most once per interval
+    # and only resources upserted since the loaded version are read.
+    # Catalogs are keyed like the database, by lower(knowledge_base) in SQLite
+    def __init__(
+        self, refresh_interval: float = SEARCH_CONFIG.catalog_refresh_interval
+    ):
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.catalogs: Dict[str, KnowledgeBaseCatalog] = {}
+        self.keys: Dict[str, str] = {}
+        self.next_refresh = 0.0
+
+    def refresh(self, force: bool = False) -> None:
+        with self.lock:
+            if not force and time.monotonic() < self.next_refresh:
+                return
+            self.keys = KnowledgeBase.get_knowledge_base_keys()
+            for key, version in Resource.get_versions().items():
+                current = self.catalogs.get(key) or KnowledgeBaseCatalog(key, -1, {})
+                if current.version == version:
+                    continue
+                changed = Resource.get_resources_changed_since(key, current.version)
+                self.catalogs[key] = current.updated(changed, version)
+                logger.info(
+                    f"Catalog of {key} at version {version}: {len(changed)} resources loaded, {len(self.catalogs[key].resources)} total"
+                )
+            self.next_refresh = time.monotonic() + self.refresh_interval
+
+    def knowledge_base_names(self) -> List[str]:
+        self.refresh()
+        return list(self.keys)
+
+    def get(self, knowledge_base: str) -> KnowledgeBaseCatalog:
+        self.refresh()
+        key = self.keys.get(knowledge_base, knowledge_base)
+        catalog = self.catalogs.get(key)
+        if catalog is None:
+            return KnowledgeBaseCatalog(key, 0, {})
+        return catalog
+
+
+RESOURCE_CATALOG = ResourceCatalog()
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from cfg import SEARCH_CONFIG
+from src.search.retrieval import knowledge_bases_version
+
+CacheKey = Tuple[str, str, str]
+
+
+def normalize_query(query: str) -> str:
+    # Case, repeated whitespace and trailing punctuation don't change what is
+    # being asked
+    return " ".join(query.lower().split()).strip(" ?!.")
+
+
+@dataclass
+class QueryCacheStats:
+    hits: int = 0
+    misses: int = 0
+    expired: int = 0
+    invalidated: int = 0
+    evicted: int = 0
+    coalesced: int = 0
+
+    def describe(self, entries: int) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return (
+            f"entries={entries} hits={self.hits} misses={self.misses} "
+            f"hit_rate={hit_rate:.1%} expired={self.expired} "
+            f"invalidated={self.invalidated} evicted={self.evicted} "
+            f"coalesced={self.coalesced}"
+        )
+
+
+class QueryCache:
+    # Entries remember the knowledge base version they were computed for, an
+    # upsert into the knowledge base makes them stale on the next lookup
+    def __init__(
+        self,
+        max_entries: int = SEARCH_CONFIG.query_cache_size,
+        ttl: float = SEARCH_CONFIG.query_cache_ttl,
+        version_interval: float = SEARCH_CONFIG.query_cache_version_interval,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version_interval = version_interval
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[CacheKey, Tuple[int, float, str]] = OrderedDict()
+        self.versions: Dict[str, Tuple[int, float]] = {}
+        self.in_flight: Dict[Tuple[CacheKey, int], asyncio.Future] = {}
+        self.stats = QueryCacheStats()
+
+    async def version(self, tag: str) -> int:
+        # The version is looked up at most once per interval so a hit never
+        # waits on the catalog - an upsert shows up within the interval. The
+        # lookup may refresh the catalog from SQLite, so it runs in a thread
+        key = tag.lower()
+        cached = self.versions.get(key)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        version = await asyncio.to_thread(knowledge_bases_version, tag)
+        self.versions[key] = (version, time.monotonic() + self.version_interval)
+        return version
+
+    def get(self, key: CacheKey, version: int) -> Optional[str]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry_version, expires_at, result = entry
+                if entry_version != version:
+                    self.stats.invalidated += 1
+                elif expires_at < time.monotonic():
+                    self.stats.expired += 1
+                else:
+                    self.entries.move_to_end(key)
+                    self.stats.hits += 1
+                    return result
+                del self.entries[key]
+            self.stats.misses += 1
+            return None
+
+    def put(self, key: CacheKey, version: int, result: str) -> None:
+        with self.lock:
+            self.entries[key] = (version, time.monotonic() + self.ttl, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats.evicted += 1
+
+    async def get_or_compute(
+        self,
+        kind: str,
+        tag: str,
+        query: str,
+        compute: Callable[[str, str], Awaitable[str]],
+        cacheable: Callable[[str], bool] = lambda result: True,
+    ) -> str:
+        key = (kind, tag.lower(), normalize_query(query))
+        version = await self.version(tag)
+        result = self.get(key, version)
+        if result is not None:
+            return result
+
+        # Identical queries arriving while the first one is still running
+        # wait for its result instead of starting their own search. The
+        # shield keeps the search going for them if the first caller goes away
+        flight_key = (key, version)
+        pending = self.in_flight.get(flight_key)
+        if pending is not None:
+            self.stats.coalesced += 1
+            return await asyncio.shield(pending)
+
+        task = asyncio.ensure_future(compute(tag, query))
+        self.in_flight[flight_key] = task
+        try:
+            result = await asyncio.shield(task)
+        finally:
+            self.in_flight.pop(flight_key, None)
+        if cacheable(result):
+            self.put(key, version, result)
+        return result
+
+    def describe(self) -> str:
+        with self.lock:
+            return self.stats.describe(len(self.entries))
@@ -0,0 +1,157 @@
+import asyncio
+import os
+from fnmatch import fnmatchcase
+from typing import Callable, List, Optional, Sequence, TypeVar
+
+from cfg import SEARCH_CONFIG
+from src.search.bm25 import search_resources
+from src.search.catalog import RESOURCE_CATALOG, CatalogEntry
+from src.search.vectors import VectorHit, search_vectors
+from src.utils.rate_limit import estimate_tokens
+
+KNOWLEDGE_BASE_MISSING = "Knowledge base does not exist."
+RETRIEVAL_ERROR = "Error retrieving resources"
+
+T = TypeVar("T")
+
+
+def resolve_knowledge_bases(tag: str) -> List[str]:
+    # A tag is a comma separated list of knowledge base names or globs, e.g.
+    # "phoenix_docs,live_view_docs" or "ash_*" - matched case-insensitively
+    names = RESOURCE_CATALOG.knowledge_base_names()
+    resolved: List[str] = []
+    for part in tag.split(","):
+        pattern = part.strip().lower()
+        for name in names:
+            if fnmatchcase(name.lower(), pattern) and name not in resolved:
+                resolved.append(name)
+    return resolved
+
+
+def knowledge_bases_version(tag: str) -> int:
+    # Versions only ever go up, so the sum changes whenever any of the
+    # resolved knowledge bases changes or a new one starts matching
+    return sum(
+        RESOURCE_CATALOG.get(kb).version for kb in resolve_knowledge_bases(tag)
+    )
+
+
+def interleave(
+    ranked_lists: Sequence[Sequence[T]], key: Callable[[T], str], limit: int
+) -> List[T]:
+    # Scores from different rankings aren't comparable, so the lists are
+    # merged round-robin by rank
+    merged: List[T] = []
+    seen = set()
+    for i in range(max((len(items) for items in ranked_lists), default=0)):
+        for items in ranked_lists:
+            if i < len(items) and key(items[i]) not in seen:
+                seen.add(key(items[i]))
+                merged.append(items[i])
+                if len(merged) == limit:
+                    return merged
+    return merged
+
+
+def format_resource_files(
+    file_paths: List[str],
+    additional_comments: str = "",
+    max_tokens: Optional[int] = SEARCH_CONFIG.max_response_tokens,
+) -> str:
+    return_string = "Here is some extra information that might help inform your responses. Use them as you see fit\n"
+    return_string += "----------------------------------------------------------\n"
+    used_tokens = 0
+    for file in file_paths:
+        if os.path.exists(file):
+            with open(file, "r") as f:
+                content = f.read()
+                file_tokens = estimate_tokens(content)
+                # The best match is always included, lower ranked files only
+                # while they fit the budget
+                if (
+                    max_tokens is not None
+                    and used_tokens
+                    and (used_tokens + file_tokens > max_tokens)
+                ):
+                    continue
+                used_tokens += file_tokens
+                return_string += f"File: {file.split('/')[-1]}\nContent:\n{content}\n\n"
+    return_string += "----------------------------------------------------------\n"
+
+    if additional_comments != "":
+        return_string += f"Additional Comments: {additional_comments}\n\n"
+
+    return return_string
+
+
+def candidate_resources(
+    knowledge_base: str, query: str, k: int = SEARCH_CONFIG.bm25_top_k
+) -> List[CatalogEntry]:
+    # Lexical and vector candidates interleaved, so exact API names and
+    # loosely worded questions both make it into the reranking prompt
+    lexical = search_resources(knowledge_base, query, k)
+    semantic = [hit.resource for hit in search_vectors(knowledge_base, query, k)]
+    return interleave([semantic, lexical], lambda r: r.summary_file_path, k)
+
+
+async def gather_candidate_resources(
+    knowledge_bases: List[str],
+    query: str,
+    k: int = SEARCH_CONFIG.bm25_top_k,
+    max_tokens: int = SEARCH_CONFIG.max_candidate_tokens,
+) -> List[CatalogEntry]:
+    # Every knowledge base is searched at the same time, so a fan-out takes
+    # about as long as the slowest knowledge base
+    per_knowledge_base = await asyncio.gather(
+        *[
+            asyncio.to_thread(candidate_resources, kb, query, k)
+            for kb in knowledge_bases
+        ]
+    )
+    candidates: List[CatalogEntry] = []
+    used_tokens = 0
+    for resource in interleave(per_knowledge_base, lambda r: r.summary_file_path, k):
+        used_tokens += resource.context_tokens
+        if candidates and used_tokens > max_tokens:
+            break
+        candidates.append(resource)
+    return candidates
+
+
+async def candidate_prompt_block(
+    knowledge_bases: List[str],
+    query: str,
+    k: int = SEARCH_CONFIG.bm25_top_k,
+    max_tokens: int = SEARCH_CONFIG.max_candidate_tokens,
+) -> str:
+    # A single small knowledge base is offered to the LLM whole, straight
+    # from the block rendered when its catalog was loaded
+    if len(knowledge_bases) == 1:
+        catalog = await asyncio.to_thread(RESOURCE_CATALOG.get, knowledge_bases[0])
+        if len(catalog.resources) <= k and catalog.prompt_tokens <= max_tokens:
+            return catalog.prompt_block
+    resources = await gather_candidate_resources(knowledge_bases, query, k, max_tokens)
+    return "\n".join(resource.context for resource in resources)
+
+
+async def get_retrieval_response(
+    tag: str, query: str, k: int = SEARCH_CONFIG.vector_top_k
+) -> str:
+    knowledge_bases = await asyncio.to_thread(resolve_knowledge_bases, tag)
+    if not knowledge_bases:
+        return KNOWLEDGE_BASE_MISSING
+
+    per_knowledge_base = await asyncio.gather(
+        *[asyncio.to_thread(search_vectors, kb, query, k) for kb in knowledge_bases]
+    )
+    # Cosine scores of the hashed vectors are comparable across knowledge
+    # bases, so hits are ranked together
+    hits: List[VectorHit] = sorted(
+        (hit for hits in per_knowledge_base for hit in hits),
+        key=lambda hit: -hit.score,
+    )[:k]
+    if not hits:
+        return "No matching resources found."
+    return await asyncio.to_thread(
+        format_resource_files, [hit.resource.summary_file_path for hit in hits]
+    )
@@ -0,0 +1,305 @@
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from cfg import IO_CONFIG, SEARCH_CONFIG
+from src.search.bm25 import tokenize
+from src.search.catalog import RESOURCE_CATALOG, CatalogEntry, KnowledgeBaseCatalog
+from src.utils.chunking import split_sections
+
+logger = logging.getLogger(__name__)
+
+# Heading of a chunk with the buckets and values of its non-zero term frequencies
+ChunkTerms = Tuple[str, np.ndarray, np.ndarray]
+
+
+def _hashed_terms(text: str, dims: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Unigrams and bigrams hashed into a fixed number of dimensions - no
+    # vocabulary to store and nothing to download. The top hash bit picks a
+    # sign so colliding terms cancel out on average instead of adding up
+    tokens = tokenize(text)
+    terms = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    hashes = np.fromiter(
+        (zlib.crc32(term.encode("utf-8")) for term in terms),
+        dtype=np.uint32,
+        count=len(terms),
+    )
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+    return (hashes % dims).astype(np.int64), signs
+
+
+def sparse_term_frequencies(text: str, dims: int) -> Tuple[np.ndarray, np.ndarray]:
+    buckets, signs = _hashed_terms(text, dims)
+    counts = np.bincount(buckets, weights=signs, minlength=dims)
+    present = np.flatnonzero(counts)
+    values = np.sign(counts[present]) * (1 + np.log(np.abs(counts[present])))
+    return present, values.astype(np.float32)
+
+
+def term_frequencies(text: str, dims: int) -> np.ndarray:
+    row = np.zeros(dims, dtype=np.float32)
+    present, values = sparse_term_frequencies(text, dims)
+    row[present] = values
+    return row
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_cosine(
+    matrix: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+    block_rows: int = SEARCH_CONFIG.vector_block_rows,
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Rows are unit length so cosine similarity is a dot product; the matrix
+    # is scanned in blocks so a memory-mapped index is never fully resident
+    best_ids = np.empty((len(queries), 0), dtype=np.int64)
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(matrix), block_rows):
+        scores = queries @ np.asarray(matrix[start : start + block_rows]).T
+        ids = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+        best_scores = np.concatenate([best_scores, scores], axis=1)
+        best_ids = np.concatenate([best_ids, ids], axis=1)
+        if best_scores.shape[1] > k:
+            keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(best_scores, keep, axis=1)
+            best_ids = np.take_along_axis(best_ids, keep, axis=1)
+
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return (
+        np.take_along_axis(best_ids, order, axis=1),
+        np.take_along_axis(best_scores, order, axis=1),
+    )
+
+
+@dataclass
+class VectorHit:
+    resource: CatalogEntry
+    heading: str
+    score: float
+
+
+class VectorIndex:
+    def __init__(
+        self,
+        matrix: np.ndarray,
+        idf: np.ndarray,
+        resources: List[CatalogEntry],
+        chunks: List[Tuple[int, str]],
+    ):
+        self.matrix = matrix
+        self.idf = idf
+        self.resources = resources
+        self.chunks = chunks
+
+    def embed(self, queries: List[str]) -> np.ndarray:
+        dims = len(self.idf)
+        rows = np.stack([term_frequencies(q, dims) for q in queries])
+        return normalize_rows(rows * self.idf)
+
+    def search(self, queries: List[str], k: int) -> List[List[VectorHit]]:
+        # Several chunks of one summary can match, so more chunks than k are
+        # fetched and collapsed to the best chunk per resource
+        if not self.chunks or not queries:
+            return [[] for _ in queries]
+        ids, scores = top_k_cosine(self.matrix, self.embed(queries), k * 4)
+
+        results: List[List[VectorHit]] = []
+        for row_ids, row_scores in zip(ids, scores):
+            hits: Dict[int, VectorHit] = {}
+            for chunk_id, score in zip(row_ids, row_scores):
+                resource_id, heading = self.chunks[chunk_id]
+                if score > 0 and resource_id not in hits:
+                    hits[resource_id] = VectorHit(
+                        self.resources[resource_id], heading, float(score)
+                    )
+            results.append(list(hits.values())[:k])
+        return results
+
+
+def _index_dir(knowledge_base: str) -> str:
+    return os.path.join(IO_CONFIG.vectors_dir, knowledge_base.lower())
+
+
+def _resource_chunks(resource: CatalogEntry) -> List[Tuple[str, str]]:
+    summary = ""
+    if os.path.exists(resource.summary_file_path):
+        with open(resource.summary_file_path, "r") as f:
+            summary = f.read()
+    chunks = []
+    for section in split_sections(summary) or [""]:
+        lines = section.strip().splitlines()
+        heading = lines[0].lstrip("#").strip() if lines else ""
+        chunks.append(
+            (heading, f"{resource.identifier}\n{resource.short_description}\n{section}")
+        )
+    return chunks
+
+
+def _resource_terms(resource: CatalogEntry, dims: int) -> List[ChunkTerms]:
+    return [
+        (heading, *sparse_term_frequencies(text, dims))
+        for heading, text in _resource_chunks(resource)
+    ]
+
+
+def build_vector_index(
+    catalog: KnowledgeBaseCatalog,
+    dims: int = SEARCH_CONFIG.vector_dims,
+    terms: Optional[Dict[str, List[ChunkTerms]]] = None,
+) -> VectorIndex:
+    knowledge_base = catalog.name
+    resources = catalog.resources
+    if terms is None:
+        terms = {r.identifier: _resource_terms(r, dims) for r in resources}
+    chunks: List[Tuple[int, str]] = []
+    rows: List[Tuple[np.ndarray, np.ndarray]] = []
+    for i, resource in enumerate(resources):
+        for heading, buckets, values in terms[resource.identifier]:
+            chunks.append((i, heading))
+            rows.append((buckets, values))
+
+    index_dir = _index_dir(knowledge_base)
+    os.makedirs(index_dir, exist_ok=True)
+    matrix_path = os.path.join(index_dir, "vectors.npy")
+    idf = np.ones(dims, dtype=np.float32)
+
+    if rows:
+        # Rows are written straight into the memory map, then weighted and
+        # normalized block by block, so building needs no dense copy in memory
+        tmp_path = matrix_path + ".tmp.npy"
+        matrix = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.float32, shape=(len(rows), dims)
+        )
+        document_frequency = np.zeros(dims, dtype=np.int64)
+        for row, (buckets, values) in enumerate(rows):
+            matrix[row, buckets] = values
+            document_frequency[buckets] += 1
+        idf = (np.log((1 + len(rows)) / (1 + document_frequency)) + 1).astype(
+            np.float32
+        )
+        for start in range(0, len(rows), SEARCH_CONFIG.vector_block_rows):
+            block = slice(start, start + SEARCH_CONFIG.vector_block_rows)
+            matrix[block] = normalize_rows(matrix[block] * idf)
+        matrix.flush()
+        del matrix
+        os.replace(tmp_path, matrix_path)
+    np.save(os.path.join(index_dir, "idf.npy"), idf)
+
+    # The metadata is written last, a crash before this point leaves a stale
+    # version behind and the index is simply rebuilt
+    with open(os.path.join(index_dir, "index.json"), "w") as f:
+        json.dump(
+            {
+                "version": catalog.version,
+                "dims": dims,
+                "resources": [
+                    {
+                        "identifier": r.identifier,
+                        "summary_file_path": r.summary_file_path,
+                        "short_description": r.short_description,
+                    }
+                    for r in resources
+                ],
+                "chunks": chunks,
+            },
+            f,
+        )
+    logger.info(
+        f"Built vector index for {knowledge_base}: {len(chunks)} chunks of {len(resources)} resources"
+    )
+    return load_vector_index(catalog)
+
+
+def load_vector_index(catalog: KnowledgeBaseCatalog) -> VectorIndex:
+    # Stored resources are resolved against the catalog of the same version,
+    # so hits share the catalog entries and their rendered context
+    index_dir = _index_dir(catalog.name)
+    with open(os.path.join(index_dir, "index.json"), "r") as f:
+        meta = json.load(f)
+    chunks = [(resource_id, heading) for resource_id, heading in meta["chunks"]]
+    matrix = (
+        np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode="r")
+        if chunks
+        else np.zeros((0, meta["dims"]), dtype=np.float32)
+    )
+    return VectorIndex(
+        matrix=matrix,
+        idf=np.load(os.path.join(index_dir, "idf.npy")),
+        resources=[catalog.entries[r["identifier"]] for r in meta["resources"]],
+        chunks=chunks,
+    )
+
+
+def _stored_version(knowledge_base: str) -> int:
+    meta_path = os.path.join(_index_dir(knowledge_base), "index.json")
+    if not os.path.exists(meta_path):
+        return -1
+    with open(meta_path, "r") as f:
+        return json.load(f)["version"]
+
+
+class VectorIndexCache:
+    # Same debounce and reuse as the BM25 indexes: rebuilds are at least
+    # rebuild_interval apart and only the chunks of changed resources are
+    # hashed again. Each knowledge base has its own lock, so a rebuild doesn't
+    # hold up searches in the others
+    def __init__(self, rebuild_interval: float = SEARCH_CONFIG.vector_rebuild_interval):
+        self.rebuild_interval = rebuild_interval
+        self.lock = threading.Lock()
+        self.locks: Dict[str, threading.Lock] = {}
+        self.indexes: Dict[str, Tuple[int, float, VectorIndex]] = {}
+        self.terms: Dict[str, Dict[str, Tuple[CatalogEntry, List[ChunkTerms]]]] = {}
+
+    def get(self, knowledge_base: str) -> VectorIndex:
+        catalog = RESOURCE_CATALOG.get(knowledge_base)
+        with self.lock:
+            lock = self.locks.setdefault(catalog.name, threading.Lock())
+        with lock:
+            cached = self.indexes.get(catalog.name)
+            if cached is not None and (
+                cached[0] == catalog.version
+                or time.monotonic() < cached[1] + self.rebuild_interval
+            ):
+                return cached[2]
+            if _stored_version(catalog.name) == catalog.version:
+                index = load_vector_index(catalog)
+            else:
+                previous = self.terms.get(catalog.name, {})
+                terms: Dict[str, Tuple[CatalogEntry, List[ChunkTerms]]] = {}
+                for r in catalog.resources:
+                    known = previous.get(r.identifier)
+                    if known is not None and known[0] is r:
+                        terms[r.identifier] = known
+                    else:
+                        terms[r.identifier] = (
+                            r,
+                            _resource_terms(r, SEARCH_CONFIG.vector_dims),
+                        )
+                index = build_vector_index(
+                    catalog,
+                    terms={identifier: t[1] for identifier, t in terms.items()},
+                )
+                self.terms[catalog.name] = terms
+            self.indexes[catalog.name] = (catalog.version, time.monotonic(), index)
+            return index
+
+
+VECTOR_INDEXES = VectorIndexCache()
+
+
+def search_vectors(
+    knowledge_base: str, query: str, k: int = SEARCH_CONFIG.vector_top_k
+) -> List[VectorHit]:
+    return VECTOR_INDEXES.get(knowledge_base).search([query], k)[0]
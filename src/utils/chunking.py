@@ -0,0 +1,66 @@
+import re
+from typing import List
+
+from src.utils.rate_limit import estimate_tokens
+
+HEADING_RE = re.compile(r"^#{1,6}\s")
+FENCE_RE = re.compile(r"^\s*(```|~~~)")
+
+
+def split_sections(markdown: str) -> List[str]:
+    # Headings inside fenced code blocks (e.g. shell comments) are not
+    # section boundaries
+    sections: List[str] = []
+    current: List[str] = []
+    in_fence = False
+    for line in markdown.splitlines(keepends=True):
+        if FENCE_RE.match(line):
+            in_fence = not in_fence
+        elif not in_fence and HEADING_RE.match(line) and current:
+            sections.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append("".join(current))
+    return sections
+
+
+def _split_oversized(section: str, max_tokens: int) -> List[str]:
+    max_chars = max_tokens * 4
+    pieces: List[str] = []
+    current: List[str] = []
+    current_chars = 0
+    for line in section.splitlines(keepends=True):
+        if current and current_chars + len(line) > max_chars:
+            pieces.append("".join(current))
+            current, current_chars = [], 0
+        while len(line) > max_chars:
+            pieces.append(line[:max_chars])
+            line = line[max_chars:]
+        current.append(line)
+        current_chars += len(line)
+    if current:
+        pieces.append("".join(current))
+    return pieces
+
+
+def chunk_markdown(markdown: str, max_tokens: int) -> List[str]:
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for section in split_sections(markdown):
+        section_tokens = estimate_tokens(section)
+        if section_tokens > max_tokens:
+            if current:
+                chunks.append("".join(current))
+                current, current_tokens = [], 0
+            chunks.extend(_split_oversized(section, max_tokens))
+            continue
+        if current and current_tokens + section_tokens > max_tokens:
+            chunks.append("".join(current))
+            current, current_tokens = [], 0
+        current.append(section)
+        current_tokens += section_tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
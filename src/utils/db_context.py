@@ -1,14 +1,88 @@
+import os
 import sqlite3
-from cfg import IO_CONFIG
+import threading
+from typing import List
+
+from cfg import DATABASE_CONFIG, IO_CONFIG
+
+
+def connect() -> sqlite3.Connection:
+    # Autocommit mode, DBCursor begins and ends every transaction itself.
+    # WAL lets readers run next to a writer, and synchronous=NORMAL only
+    # syncs at checkpoints instead of on every commit
+    conn = sqlite3.connect(
+        IO_CONFIG.db_path,
+        isolation_level=None,
+        check_same_thread=False,
+        timeout=DATABASE_CONFIG.busy_timeout_ms / 1000,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute(f"PRAGMA synchronous = {DATABASE_CONFIG.synchronous};")
+    conn.execute(f"PRAGMA busy_timeout = {DATABASE_CONFIG.busy_timeout_ms};")
+    conn.execute(f"PRAGMA mmap_size = {DATABASE_CONFIG.mmap_size};")
+    conn.execute(f"PRAGMA cache_size = -{DATABASE_CONFIG.cache_size_kib};")
+    return conn
+
+
+class ConnectionPool:
+    # Connections are reused instead of opened per query. Each one is used by
+    # a single thread at a time - whichever thread acquires it next - and
+    # connections beyond max_idle are closed when released
+    def __init__(self, max_idle: int = DATABASE_CONFIG.max_idle_connections):
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle: List[sqlite3.Connection] = []
+        self.pid = os.getpid()
+
+    def acquire(self) -> sqlite3.Connection:
+        with self.lock:
+            if self.pid != os.getpid():
+                # A forked child must not use the parent's connections
+                self.idle = []
+                self.pid = os.getpid()
+            if self.idle:
+                return self.idle.pop()
+        return connect()
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        with self.lock:
+            if (
+                not conn.in_transaction
+                and self.pid == os.getpid()
+                and len(self.idle) < self.max_idle
+            ):
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def close_all(self) -> None:
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+
+DB_POOL = ConnectionPool()
 
 
 class DBCursor:
+    # Every block is one transaction: committed when it completes, rolled back
+    # when it raises
     def __enter__(self) -> sqlite3.Cursor:
-        self.conn = sqlite3.connect(IO_CONFIG.db_path)
-        self.conn.row_factory = sqlite3.Row
+        self.conn = DB_POOL.acquire()
+        self.conn.execute("BEGIN;")
         self.cur = self.conn.cursor()
         return self.cur
 
     def __exit__(self, exc_type, exc_val, exc_tb) -> None:
-        self.conn.commit()
-        self.conn.close()
+        try:
+            if exc_type is None:
+                self.conn.execute("COMMIT;")
+            else:
+                self.conn.execute("ROLLBACK;")
+        finally:
+            self.cur.close()
+            if self.conn.in_transaction:
+                self.conn.rollback()
+            DB_POOL.release(self.conn)
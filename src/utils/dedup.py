@@ -0,0 +1,77 @@
+import hashlib
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+WORD_RE = re.compile(r"\w+")
+FINGERPRINT_BITS = 64
+
+
+def _shingles(words: List[str], size: int) -> Counter:
+    if len(words) < size:
+        return Counter([" ".join(words)]) if words else Counter()
+    return Counter(" ".join(words[i : i + size]) for i in range(len(words) - size + 1))
+
+
+def simhash(text: str, shingle_size: int = 3, min_words: int = 0) -> Optional[int]:
+    # Very short documents don't carry enough shingles for a stable
+    # fingerprint, they are left out of deduplication
+    words = WORD_RE.findall(text.lower())
+    if not words or len(words) < min_words:
+        return None
+    shingles = _shingles(words, shingle_size)
+
+    digests = b"".join(
+        hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest() for s in shingles
+    )
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1)
+    weights = np.fromiter(shingles.values(), dtype=np.int64, count=len(shingles))
+    scores = weights @ (bits.astype(np.int64) * 2 - 1)
+    return int.from_bytes(np.packbits(scores > 0).tobytes(), "big")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class NearDuplicateIndex:
+    # LSH banding over SimHash fingerprints: with more bands than the allowed
+    # distance, two fingerprints within max_distance bits always share at
+    # least one identical band, so only same-bucket candidates are compared
+    def __init__(self, max_distance: int = 3, bands: int = 4):
+        if bands <= max_distance:
+            raise ValueError("bands must exceed max_distance to guarantee recall")
+        self.max_distance = max_distance
+        self.band_bits = FINGERPRINT_BITS // bands
+        self.band_mask = (1 << self.band_bits) - 1
+        self.buckets: List[Dict[int, List[str]]] = [
+            defaultdict(list) for _ in range(bands)
+        ]
+        self.fingerprints: Dict[str, int] = {}
+
+    def _bands(self, fingerprint: int) -> List[int]:
+        return [
+            (fingerprint >> (i * self.band_bits)) & self.band_mask
+            for i in range(len(self.buckets))
+        ]
+
+    def find(self, fingerprint: int) -> Optional[str]:
+        for buckets, band in zip(self.buckets, self._bands(fingerprint)):
+            for candidate in buckets.get(band, ()):
+                if (
+                    hamming_distance(fingerprint, self.fingerprints[candidate])
+                    <= self.max_distance
+                ):
+                    return candidate
+        return None
+
+    def add(self, identifier: str, fingerprint: int) -> Optional[str]:
+        representative = self.find(fingerprint)
+        if representative is not None:
+            return representative
+        self.fingerprints[identifier] = fingerprint
+        for buckets, band in zip(self.buckets, self._bands(fingerprint)):
+            buckets[band].append(identifier)
+        return None
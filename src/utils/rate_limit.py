@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate: float) -> None:
+        self._refill()
+        self.rate = rate
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        # Requests larger than the bucket would never fit - let them drain it
+        tokens = min(tokens, self.capacity)
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English prose and code
+    return len(text) // 4 + 1
+
+
+class LLMRateLimiter:
+    def __init__(
+        self,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        burst_seconds: float = 5.0,
+    ):
+        request_rate = requests_per_minute / 60
+        token_rate = tokens_per_minute / 60
+        self.requests = TokenBucket(request_rate, max(1.0, request_rate * burst_seconds))
+        self.tokens = TokenBucket(token_rate, max(1.0, token_rate * burst_seconds))
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        await self.requests.acquire(1)
+        await self.tokens.acquire(estimated_tokens)
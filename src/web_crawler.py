@@ -1,8 +1,9 @@
 import asyncio
 import os
-from urllib.parse import urljoin, urlparse
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from urllib.parse import urlparse
 
-from bs4 import BeautifulSoup
 from crawl4ai import (
     AsyncWebCrawler,
     BrowserConfig,
@@ -10,41 +11,51 @@ from crawl4ai import (
     CrawlResult,
     CrawlerRunConfig,
 )
-from cfg import IO_CONFIG
+from cfg import CRAWL_CONFIG, IO_CONFIG
 import logging
-from typing import List
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
 from scripts.db_init import db_init
+import httpx
+from src.crawler.frontier import CrawlFrontier, FrontierEntry
+from src.crawler.postprocess import ProcessedPage, process_page
+from src.crawler.politeness import (
+    THROTTLE_STATUS_CODES,
+    HostScheduler,
+    RateLimited,
+    parse_retry_after,
+)
+from src.crawler.robots import fetch_robots
+from src.crawler.sitemap import iter_sitemap_entries
+from src.models.crawl import CrawlManifestEntry, FrontierRecord, utc_now
+from src.models.jobs import JobsConfig
 from src.models.knowledge import KnowledgeBase
-import requests
-import re
-from typing import Tuple
 
 from utils.loggers import setup_stdout_logging
 
 logger = logging.getLogger(__name__)
 
 
-def get_sitemap(base_url: str):
-    sitemap_url = urljoin(base_url, "/sitemap.xml")
-    try:
-        response = requests.get(sitemap_url)
-        if response.status_code == 200:
-            return response.text
-        else:
-            logger.warning(f"Failed to fetch sitemap from {sitemap_url}")
-    except Exception as e:
-        logger.error(f"Error fetching sitemap from {sitemap_url}: {e}")
-    return None
+@dataclass
+class CrawlSession:
+    base_url: str
+    knowledge_base: str
+    output_dir: str
+    redo: bool
+    refresh: bool
+    run_config: CrawlerRunConfig
+    frontier: CrawlFrontier
+    client: httpx.AsyncClient
+    manifest: Dict[str, CrawlManifestEntry]
+    scheduler: HostScheduler
+    executor: Optional[ProcessPoolExecutor]
+    page_sink: Optional[Callable[[str], Awaitable[None]]] = None
 
 
-def parse_sitemap_into_links(sitemap: str):
-    return [
-        r.replace("</loc>", "")
-        for r in re.findall(
-            r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+",
-            sitemap,
-        )
-    ]
+def page_file_for(output_dir: str, url: str) -> str:
+    return os.path.join(
+        output_dir, *urlparse(url).path.strip("/").split("/"), "page.md"
+    )
 
 
 async def scrape_website(
@@ -54,144 +65,225 @@ async def scrape_website(
     redo: bool = False,
     ignored_tags: list[str] = [],
     alternative_seeds: List[str] = [],
+    max_concurrency: int = CRAWL_CONFIG.max_concurrency,
+    refresh: bool = False,
+    resume: bool = True,
+    scheduler: Optional[HostScheduler] = None,
+    process_workers: int = CRAWL_CONFIG.process_workers,
+    page_sink: Optional[Callable[[str], Awaitable[None]]] = None,
 ) -> None:
     if not ignored_tags:
         ignored_tags = ["form", "nav", "footer"]
 
-    base_name = urlparse(base_url).netloc  # Extract domain name
     output_dir = os.path.join(IO_CONFIG.docs_dir, knowledge_base)
     os.makedirs(output_dir, exist_ok=True)
 
-    await _scrape_recursive(
-        url=base_url,
-        depth=0,
-        output_dir=output_dir,
-        max_depth=max_depth,
-        base_url=base_url,
-        redo=redo,
-        ignored_tags=ignored_tags,
-        visited_urls=set(),
+    frontier = CrawlFrontier(knowledge_base)
+    if not (resume and frontier.restore()):
+        FrontierRecord.clear_frontier(knowledge_base)
+    frontier.push(base_url, depth=0, max_depth=max_depth)
+    for seed in alternative_seeds:
+        frontier.push(seed, depth=0, max_depth=1)
+
+    browser_config = BrowserConfig(
+        headless=True,
+        viewport_width=CRAWL_CONFIG.viewport_width,
+        viewport_height=CRAWL_CONFIG.viewport_height,
     )
 
-    for seed in alternative_seeds:
-        await _scrape_recursive(
-            url=seed,
-            depth=0,
-            output_dir=output_dir,
-            max_depth=1,
-            base_url=base_url,
-            redo=redo,
-            ignored_tags=ignored_tags,
-            visited_urls=set(),
-        )
+    executor = (
+        ProcessPoolExecutor(max_workers=process_workers)
+        if process_workers > 0
+        else None
+    )
+    scheduler = scheduler or HostScheduler()
 
-    maybe_sitemap = get_sitemap(base_url)
-    if maybe_sitemap:
-        links = parse_sitemap_into_links(maybe_sitemap)
-        for link in links:
-            if link.startswith(base_url):
-                await _scrape_recursive(
-                    url=link,
-                    depth=0,
-                    output_dir=output_dir,
-                    max_depth=0,
-                    base_url=base_url,
-                    redo=redo,
-                    ignored_tags=ignored_tags,
-                    visited_urls=set(),
-                )
-
-
-async def _scrape_recursive(
-    url: str,
-    depth: int,
-    output_dir: str,
-    max_depth: int,
-    base_url: str,
-    redo: bool,
-    ignored_tags: list[str],
-    visited_urls: set[str],
-) -> None:
-    if depth > max_depth or url in visited_urls:
-        return
+    try:
+        # One browser for the whole crawl - every worker opens its own page in it
+        async with httpx.AsyncClient(
+            follow_redirects=True, timeout=CRAWL_CONFIG.http_timeout
+        ) as client, AsyncWebCrawler(config=browser_config) as crawler:
+            session = CrawlSession(
+                base_url=base_url,
+                knowledge_base=knowledge_base,
+                output_dir=output_dir,
+                redo=redo,
+                refresh=refresh,
+                run_config=CrawlerRunConfig(
+                    cache_mode=CacheMode.BYPASS,
+                    word_count_threshold=200,
+                    wait_for="body",
+                    excluded_tags=["form", "nav", "footer", "header"] + ignored_tags,
+                ),
+                frontier=frontier,
+                client=client,
+                manifest=CrawlManifestEntry.get_manifest(knowledge_base),
+                scheduler=scheduler,
+                executor=executor,
+                page_sink=page_sink,
+            )
+            robots = await fetch_robots(client, base_url)
+            session.scheduler.apply_robots(base_url, robots)
 
-    page_dir = os.path.join(output_dir, *urlparse(url).path.strip("/").split("/"))
-    output_file = os.path.join(page_dir, "page.md")
+            workers = [
+                asyncio.create_task(_crawl_worker(crawler, session))
+                for _ in range(max(1, max_concurrency))
+            ]
+            try:
+                # Sitemap urls are streamed into the frontier while the workers
+                # are already rendering pages
+                async for entry in iter_sitemap_entries(client, base_url, robots):
+                    if entry.loc.startswith(base_url):
+                        frontier.push(
+                            entry.loc, depth=0, max_depth=0, lastmod=entry.lastmod
+                        )
+                await frontier.join()
+            finally:
+                frontier.close()
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
 
-    if not redo and os.path.exists(output_file):
-        logger.info(f"Already scraped {url} - depth {depth}")
-        return
 
-    visited_urls.add(url)
+async def _crawl_worker(crawler: AsyncWebCrawler, session: CrawlSession) -> None:
+    while True:
+        entry = await session.frontier.pop()
+        try:
+            links = await _scrape_page(crawler, session, entry)
+        except RateLimited as e:
+            logger.warning(f"Rate limited on {entry.url}: {e}")
+            session.frontier.fail(entry, str(e), retry_after=e.retry_after)
+        except Exception as e:
+            logger.error(f"Error scraping {entry.url}: {e}")
+            session.frontier.fail(entry, str(e))
+        else:
+            # Handing the page on before completing the entry means join()
+            # only returns once every page was accepted downstream
+            try:
+                output_file = page_file_for(session.output_dir, entry.url)
+                if session.page_sink is not None and os.path.exists(output_file):
+                    await session.page_sink(output_file)
+            finally:
+                session.frontier.complete(entry, links)
 
-    browser_config = BrowserConfig(
-        headless=True,
-        viewport_width=1920,
-        viewport_height=1080,
-    )
 
-    run_config_pre = CrawlerRunConfig(
-        cache_mode=CacheMode.BYPASS,
-        word_count_threshold=200,
-        wait_for="body",
+def _get_header(headers: Optional[Dict[str, str]], name: str) -> Optional[str]:
+    for key, value in (headers or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+async def _is_unchanged(
+    session: CrawlSession, entry: FrontierEntry, known: CrawlManifestEntry
+) -> bool:
+    if entry.lastmod is not None:
+        return known.fetched_at_datetime() >= entry.lastmod
+
+    headers = known.conditional_headers()
+    if not headers:
+        return False
+    # A HEAD request, so a server that ignores the validators doesn't send the
+    # whole page just to have it thrown away before the render
+    async with session.scheduler.slot(entry.url):
+        try:
+            response = await session.client.head(entry.url, headers=headers)
+        except httpx.HTTPError as e:
+            await session.scheduler.record(entry.url, None, None)
+            logger.warning(f"Conditional request for {entry.url} failed: {e}")
+            return False
+        retry_after = parse_retry_after(response.headers.get("retry-after"))
+        # A HEAD is far quicker than a render, its latency would skew the
+        # baseline the renders are judged against
+        await session.scheduler.record(
+            entry.url, None, response.status_code, retry_after
+        )
+
+    if response.status_code in THROTTLE_STATUS_CODES:
+        raise RateLimited(entry.url, response.status_code, retry_after)
+    if response.status_code == 304:
+        return True
+    # Servers that ignore conditional requests still report their validators
+    return response.status_code == 200 and known.matches_validators(
+        response.headers.get("etag"), response.headers.get("last-modified")
     )
-    run_config_post = CrawlerRunConfig(
-        cache_mode=CacheMode.BYPASS,
-        word_count_threshold=200,
-        wait_for="body",
-        excluded_tags=["form", "nav", "footer", "header"] + ignored_tags,
+
+
+async def _postprocess(
+    session: CrawlSession, url: str, result: CrawlResult
+) -> ProcessedPage:
+    args = (url, result.html or "", str(result.markdown or ""), session.base_url)
+    if session.executor is None:
+        return process_page(*args)
+    return await asyncio.get_running_loop().run_in_executor(
+        session.executor, process_page, *args
     )
 
-    try:
-        async with AsyncWebCrawler(config=browser_config) as crawler:
-            pre_post = [
-                crawler.arun(url, config=run_config_pre),
-                crawler.arun(url, config=run_config_post),
-            ]
 
-            r: Tuple[CrawlResult, CrawlResult] = await asyncio.gather(*pre_post)  # type: ignore
-            result_pre, result_post = r
+async def _scrape_page(
+    crawler: AsyncWebCrawler, session: CrawlSession, entry: FrontierEntry
+) -> List[str]:
+    url = entry.url
+    output_file = page_file_for(session.output_dir, url)
+    known = session.manifest.get(entry.key)
+
+    if not session.redo and os.path.exists(output_file):
+        if not session.refresh:
+            logger.info(f"Already scraped {url} - depth {entry.depth}")
+            return known.links if known else []
+        if known and await _is_unchanged(session, entry, known):
+            logger.info(f"Unchanged {url} - depth {entry.depth}")
+            known.fetched_at = utc_now()
+            known.upsert_entry()
+            return known.links
 
-            markdown = result_post.markdown
+    # A single render: excluded_tags only shape the markdown, result.html is
+    # still the raw page so navigation links remain available for the frontier
+    async with session.scheduler.slot(url):
+        started = time.monotonic()
+        result: CrawlResult = await crawler.arun(url, config=session.run_config)  # type: ignore
+        status_code = result.status_code if result.success else None
+        retry_after = parse_retry_after(
+            _get_header(result.response_headers, "retry-after")
+        )
+        await session.scheduler.record(
+            url, time.monotonic() - started, status_code, retry_after
+        )
 
-            if not markdown or "404" in markdown and len(markdown) < 500:
-                logger.warning(f"{url} is empty or a 404.")
-            else:
-                os.makedirs(page_dir, exist_ok=True)
-                with open(output_file, "w") as f:
-                    f.write(markdown.strip())
-                logger.info(f"Scraped {url} to {output_file}")
+    if result.status_code in THROTTLE_STATUS_CODES:
+        raise RateLimited(url, result.status_code, retry_after)
+    if not result.success:
+        raise RuntimeError(result.error_message or "crawl failed")
 
-            # Extract and follow links
-            soup = BeautifulSoup(result_pre.html, "html.parser")
-            links = [
-                urljoin(url, a.get("href")) for a in soup.find_all("a") if a.get("href")  # type: ignore
-            ]
-            valid_links = {
-                link.split("#")[0]
-                for link in links
-                if link.startswith(base_url)
-                and (
-                    urlparse(link).path.endswith((".html", ".md"))
-                    or urlparse(link).path.split("/")[-1].split(".")[0]
-                    == urlparse(link).path.split("/")[-1]
-                )
-            }  # Only crawl links that start with base URL and end with .html or / or .md or has no extension (is not a file)
-
-            for link in valid_links:
-                await _scrape_recursive(
-                    url=link,
-                    depth=depth + 1,
-                    output_dir=output_dir,
-                    max_depth=max_depth,
-                    base_url=base_url,
-                    redo=redo,
-                    ignored_tags=ignored_tags,
-                    visited_urls=visited_urls,
-                )
-
-    except Exception as e:
-        logger.error(f"Error scraping {url}: {e}")
+    page = await _postprocess(session, url, result)
+
+    if page.markdown is None:
+        logger.warning(f"{url} is empty or a 404.")
+    elif known and known.content_hash == page.content_hash and os.path.exists(
+        output_file
+    ):
+        logger.info(f"Content unchanged {url} - depth {entry.depth}")
+    else:
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        with open(output_file, "w") as f:
+            f.write(page.markdown)
+        logger.info(f"Scraped {url} to {output_file} - depth {entry.depth}")
+
+    manifest_entry = CrawlManifestEntry(
+        knowledge_base=session.knowledge_base,
+        url=entry.key,
+        etag=_get_header(result.response_headers, "etag"),
+        last_modified=_get_header(result.response_headers, "last-modified"),
+        content_hash=page.content_hash,
+        links=page.links,
+    )
+    manifest_entry.upsert_entry()
+    session.manifest[entry.key] = manifest_entry
+
+    return page.links
 
 
 def run_scraper(
@@ -201,6 +293,10 @@ def run_scraper(
     redo: bool = False,
     ignored_tags: List[str] = [],
     alternative_seeds: List[str] = [],
+    max_concurrency: int = CRAWL_CONFIG.max_concurrency,
+    refresh: bool = False,
+    resume: bool = True,
+    process_workers: int = CRAWL_CONFIG.process_workers,
 ):
     use_base = base_url if base_url.endswith("/") else base_url + "/"
     KnowledgeBase.create_knowledge_base(knowledge_base, base_url)
@@ -212,6 +308,10 @@ def run_scraper(
             redo=redo,
             ignored_tags=ignored_tags,
             alternative_seeds=alternative_seeds,
+            max_concurrency=max_concurrency,
+            refresh=refresh,
+            resume=resume,
+            process_workers=process_workers,
         )
     )
 
@@ -219,80 +319,15 @@ def run_scraper(
 if __name__ == "__main__":
     db_init()
     setup_stdout_logging()
-    run_scraper(
-        base_url="https://zed.dev/docs/",
-        knowledge_base="zed_docs",
-        redo=False,
-    )
-    run_scraper(
-        base_url="https://docs.agno.com/",
-        alternative_seeds=[
-            "https://docs.agno.com/examples/getting-started/custom-tools",
-            "https://docs.agno.com/examples/concepts/multimodal/audio-sentiment-analysis",
-            "https://docs.agno.com/examples/agents/finance-agent",
-            "https://docs.agno.com/examples/workflows/blog-post-generator",
-            "https://docs.agno.com/examples/concepts/rag/traditional-rag-pgvector",
-            "https://docs.agno.com/examples/concepts/knowledge/arxiv-kb",
-            "https://docs.agno.com/examples/concepts/memory/builtin-memory",
-            "https://docs.agno.com/examples/concepts/teams/news-agency-team",
-            "https://docs.agno.com/examples/concepts/async/basic",
-            "https://docs.agno.com/examples/concepts/hybrid-search/lancedb",
-            "https://docs.agno.com/examples/concepts/storage/dynamodb",
-            "https://docs.agno.com/examples/concepts/tools/duckduckgo",
-            "https://docs.agno.com/examples/concepts/vectordb/cassandra",
-            "https://docs.agno.com/examples/concepts/embedders/azure-embedder",
-            "https://docs.agno.com/examples/models/openai/basic",
-        ],
-        knowledge_base="agno_docs",
-        redo=False,
-    )
-    run_scraper(
-        base_url="https://hexdocs.pm/ash/",
-        knowledge_base="ash_docs",
-        redo=False,
-    )
-    run_scraper(
-        base_url="https://hexdocs.pm/ash_phoenix/",
-        knowledge_base="ash_docs_phoenix",
-        redo=False,
-    )
-    run_scraper(
-        base_url="https://hexdocs.pm/ash_postgres/",
-        knowledge_base="ash_docs_postgres",
-        redo=False,
-    )
-    run_scraper(
-        base_url="https://hexdocs.pm/ash_authentication/",
-        knowledge_base="ash_docs_authentication",
-        redo=False,
-    )
-    run_scraper(
-        base_url="https://hexdocs.pm/ash_json_api/",
-        knowledge_base="ash_docs_json",
-        redo=False,
-    )
-    run_scraper(
-        base_url="https://hexdocs.pm/ecto/",
-        knowledge_base="ecto_docs",
-        redo=False,
-    )
-    run_scraper(
-        base_url="https://hexdocs.pm/phoenix/",
-        knowledge_base="phoenix_docs",
-        redo=False,
-    )
-    run_scraper(
-        base_url="https://hexdocs.pm/phoenix_live_view/",
-        knowledge_base="live_view_docs",
-        redo=False,
-    )
-    run_scraper(
-        base_url="https://fastapi.tiangolo.com/",
-        knowledge_base="fastapi_docs",
-        redo=False,
-    )
-    run_scraper(
-        base_url="https://fly.io/docs/",
-        knowledge_base="fly_docs",
-        redo=False,
-    )
+    # Runs the configured sites one after another - src/runner.py crawls them
+    # concurrently
+    for spec in JobsConfig.load().enabled_knowledge_bases():
+        run_scraper(
+            base_url=spec.base_url,
+            knowledge_base=spec.name,
+            max_depth=spec.max_depth,
+            redo=spec.redo,
+            ignored_tags=spec.ignored_tags,
+            alternative_seeds=spec.alternative_seeds,
+            refresh=spec.refresh,
+        )